@@ -0,0 +1,76 @@
+from config import load_config
+
+config = load_config()
+
+
+class AimdController:
+    """Размер пачки, подстраиваемый по принципу AIMD: пока пачка
+    обрабатывается быстрее целевого времени, размер растет на постоянный
+    шаг, при превышении времени или отказе сервера - уменьшается вдвое.
+    Если задан max_bytes, размер дополнительно ограничивается так, чтобы
+    пачка документов среднего размера не превышала max_bytes.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        target_seconds: float,
+        decrease: float = 0.5,
+        max_bytes: int = 0,
+    ):
+        self.minimum = min(minimum, initial)
+        self.maximum = max(maximum, initial)
+        self.target_seconds = target_seconds
+        self.decrease = decrease
+        self.max_bytes = max_bytes
+        self.value = initial
+        self.increase = max(1, initial // 10)
+
+    def update(
+        self, seconds: float, rejected: bool = False, document_bytes: float = 0
+    ) -> int:
+        """Функция пересчитывает размер пачки по результату обработки.
+
+        Args:
+            seconds (float): Время обработки пачки текущего размера.
+            rejected (bool, optional): Сервер отклонил часть запроса. Defaults to False.
+            document_bytes (float, optional): Средний размер документа в байтах. Defaults to 0.
+
+        Returns:
+            int: Новый размер пачки.
+        """
+        if rejected or seconds > self.target_seconds:
+            self.value = max(self.minimum, int(self.value * self.decrease))
+        else:
+            self.value = min(self.maximum, self.value + self.increase)
+        if self.max_bytes and document_bytes:
+            limit = max(self.minimum, int(self.max_bytes // document_bytes))
+            self.value = min(self.value, limit)
+        return self.value
+
+
+class BatchSizes:
+    """Размеры пачек одной таблицы: LIMIT выборки измененных строк и
+    количество документов в одном запросе bulk. Если подстройка выключена
+    (ADAPTIVE_BATCHES), размеры остаются равными LIMIT и ES_BULK_CHUNK_SIZE.
+    """
+
+    def __init__(self):
+        adaptive = config.adaptive
+        limit = config.extractor.limit
+        chunk_size = config.elasticsearch.bulk_chunk_size
+        if adaptive.enabled:
+            limit_bounds = adaptive.limit_min, adaptive.limit_max
+            chunk_bounds = adaptive.chunk_min, adaptive.chunk_max
+        else:
+            limit_bounds = limit, limit
+            chunk_bounds = chunk_size, chunk_size
+        self.limit = AimdController(limit, *limit_bounds, adaptive.limit_seconds)
+        self.chunk_size = AimdController(
+            chunk_size,
+            *chunk_bounds,
+            adaptive.chunk_seconds,
+            max_bytes=config.elasticsearch.bulk_max_chunk_bytes,
+        )
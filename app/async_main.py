@@ -0,0 +1,216 @@
+import asyncio
+import signal
+from datetime import datetime
+from typing import Sequence
+
+from backoff import async_backoff
+from elasticsearch_class import AsyncElasticSearchLoader
+from main import (
+    AGGREGATE_MODE,
+    ExtractFilmWork,
+    ExtractGenre,
+    ExtractPerson,
+    Transform,
+    chunked,
+    config,
+    dsn,
+    row_cursor,
+    shard_prefix,
+)
+from main_logger import MainLogger
+from metrics import (
+    BATCH_ROWS,
+    async_timed,
+    install_profiler,
+    observe_lag,
+    start_server,
+)
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import RowFactory, dict_row, tuple_row
+from psycopg_pool import AsyncConnectionPool
+from state import get_state
+
+logger = MainLogger().get_logger("async_main")
+
+
+class AsyncDatabase:
+
+    def __init__(self, pg_data: dict):
+        self.pool = AsyncConnectionPool(
+            conninfo=make_conninfo(**pg_data),
+            kwargs={"row_factory": dict_row},
+            min_size=config.postgres.pool_min_size,
+            max_size=config.postgres.pool_max_size,
+            open=False,
+        )
+
+    async def open(self) -> None:
+        """Функция открывает пул подключений к базе данных."""
+        logger.info("Подключение к Postgres.")
+        await self.pool.open(wait=True)
+        logger.info("подключено успешно.")
+
+    @async_backoff()
+    @async_timed("postgres")
+    async def make_query(
+        self, statement: str, params: Sequence = None, row_factory: RowFactory = None
+    ) -> list:
+        """Функция выполняет запрос к базе данных на свободном подключении из пула.
+
+        Args:
+            statement (str): Запрос для выполнения.
+            params (Sequence, optional): Параметры запроса. Defaults to None.
+            row_factory (RowFactory, optional): Фабрика строк, например tuple_row. Defaults to dict_row подключения.
+
+        Returns:
+            list: Полученные данные.
+        """
+        async with self.pool.connection() as conn:
+            cursor = await conn.cursor(row_factory=row_factory).execute(
+                statement, params, prepare=config.postgres.prepare
+            )
+            return await cursor.fetchall()
+
+    async def close_connection(self) -> None:
+        await self.pool.close()
+
+
+class AsyncEtlProcess:
+    """Процесс на asyncio. Таблицы film_work, person и genre обходятся по
+    очереди в каждой итерации, как в синхронном процессе: при одновременной
+    обработке задача person/genre могла прочитать фильм до его изменения
+    и записать устаревший документ поверх нового. Одновременно загружаются
+    пачки фильмов одной таблицы. Запросы формируются теми же экстракторами,
+    что и в синхронном процессе.
+    """
+
+    def __init__(self):
+        prefix = shard_prefix(config.shard.index, config.shard.count)
+        self.state = get_state(prefix=prefix)
+        start_server(config.metrics.port, config.shard.index)
+        install_profiler(config.metrics.profile_dir)
+        self.db = AsyncDatabase(pg_data=dsn)
+        self.transformer = Transform()
+        self.es_loader = AsyncElasticSearchLoader(prefix=prefix)
+        shard = {
+            "shard_index": config.shard.index,
+            "shard_count": config.shard.count,
+        }
+        self.extractors = {
+            "film_work": ExtractFilmWork(db=self.db, state=self.state, **shard),
+            "person": ExtractPerson(db=self.db, state=self.state, **shard),
+            "genre": ExtractGenre(db=self.db, state=self.state, **shard),
+        }
+
+    async def start(self):
+        """Функция запускает процесс. По SIGTERM основная задача отменяется,
+        и состояние сохраняется в блоке finally.
+        """
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
+        await self.db.open()
+        await self.es_loader.create_index()
+        logger.info("Процесс запущен.")
+        try:
+            while True:
+                is_idle = True
+                for table_name in self.extractors:
+                    if await self.process_table(table_name):
+                        is_idle = False
+                if is_idle:
+                    await asyncio.sleep(0.5)
+        finally:
+            self.state.flush()
+            await self.db.close_connection()
+            await self.es_loader.close()
+
+    async def process_table(self, table_name: str) -> int:
+        """Функция обрабатывает все накопившиеся изменения в указанной таблице.
+
+        Args:
+            table_name (str): Название таблицы.
+
+        Returns:
+            int: Количество обработанных строк таблицы.
+        """
+        counter = 0
+        while processed := await self.universal_process(table_name):
+            counter += processed
+        return counter
+
+    async def database_now(self) -> datetime:
+        """Функция возвращает текущее время по часам базы."""
+        rows = await self.db.make_query("SELECT localtimestamp AS now")
+        return rows[0]["now"]
+
+    async def universal_process(self, table_name: str) -> int:
+        """Функция получает/трансформирует/вставляет одну пачку измененных
+            строк таблицы.
+
+        Args:
+            table_name (str): Название таблицы.
+
+        Returns:
+            int: Количество обработанных строк таблицы.
+        """
+        extractor = self.extractors[table_name]
+        previous = self.state.get_storage(table_name)
+        rows = await self.db.make_query(*extractor.extract_statement(previous))
+        if not rows:
+            observe_lag(table_name, None, await self.database_now())
+            return 0
+        BATCH_ROWS.labels(table_name).observe(len(rows))
+        logger.info(f"Из таблицы %s получено %s записей", table_name, len(rows))
+        if table_name == "film_work":
+            await self.load_movies(extractor, rows)
+        else:
+            rows_id = tuple(row["id"] for row in rows)
+            movies_list = await self.db.make_query(
+                *extractor.movies_list_statement(rows_id)
+            )
+            await asyncio.gather(
+                *(
+                    self.load_movies(extractor, movies_chunk)
+                    for movies_chunk in chunked(movies_list, config.extractor.limit)
+                )
+            )
+        if not self.state.compare_and_set(table_name, previous, row_cursor(rows[-1])):
+            logger.warning(
+                "Курсор таблицы %s изменен другим процессом, продолжаю с него.",
+                table_name,
+            )
+        self.state.checkpoint()
+        observe_lag(table_name, rows[-1]["modified"], await self.database_now())
+        return len(rows)
+
+    async def load_movies(self, extractor, movies_list: list) -> None:
+        """Функция получает финальные данные по фильмам, трансформирует их
+            и загружает в ES.
+
+        Args:
+            extractor (BaseExtractor): Экстрактор, формирующий запрос.
+            movies_list (list): Список фильмов для загрузки.
+        """
+        data = await self.db.make_query(
+            *extractor.get_movies_statement(movies_list), row_factory=tuple_row
+        )
+        if config.extractor.mode == AGGREGATE_MODE:
+            transform = self.transformer.prepare_aggregated_data
+        else:
+            transform = self.transformer.prepare_data
+        # трансформация выполняется в потоке, чтобы не останавливать цикл
+        # событий и загрузку остальных пачек, запущенных через gather
+        prepared_data = await asyncio.get_running_loop().run_in_executor(
+            None, transform, data
+        )
+        await self.es_loader.bulk_insert_data(prepared_data)
+        logger.info(f"Успешно загружено %s документов", len(movies_list))
+
+
+if __name__ == "__main__":
+    etl = AsyncEtlProcess()
+    try:
+        asyncio.run(etl.start())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        exit()
@@ -1,8 +1,10 @@
+import asyncio
 import time
 from functools import wraps
 
 from elasticsearch.exceptions import ConnectionError
 from main_logger import MainLogger
+from metrics import BACKOFF_RETRIES
 from psycopg import OperationalError
 
 logger = MainLogger().get_logger("backoff")
@@ -27,6 +29,7 @@ def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
                 try:
                     return func(instance, *args, **kwargs)
                 except (ConnectionError, OperationalError):
+                    BACKOFF_RETRIES.labels(func.__name__).inc()
                     time_to_sleep = start_sleep_time * (factor**counter)
                     if time_to_sleep > border_sleep_time:
                         time_to_sleep = border_sleep_time
@@ -41,3 +44,36 @@ def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
         return inner
 
     return func_wrapper
+
+
+def async_backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
+    """Асинхронный вариант backoff для корутин.
+
+    Args:
+        start_sleep_time (float, optional): Начальное время ожидания. Defaults to 0.1.
+        factor (int, optional): Величина, от которой зависит увеличение ожидания. Defaults to 2.
+        border_sleep_time (int, optional): Максимальное время ожидания. Defaults to 10.
+    """
+
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(instance, *args, **kwargs):
+            counter = 0
+            while True:
+                try:
+                    return await func(instance, *args, **kwargs)
+                except (ConnectionError, OperationalError):
+                    BACKOFF_RETRIES.labels(func.__name__).inc()
+                    time_to_sleep = min(
+                        start_sleep_time * (factor**counter), border_sleep_time
+                    )
+                    logger.info(
+                        "Пробую подключиться к базе данных повторно. Жду %s",
+                        time_to_sleep,
+                    )
+                    counter += 1
+                    await asyncio.sleep(time_to_sleep)
+
+        return inner
+
+    return func_wrapper
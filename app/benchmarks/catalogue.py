@@ -0,0 +1,263 @@
+"""Генератор синтетического каталога в схеме content.
+
+Пропорции взяты из database_dump.sql: на фильм в среднем ~0.8 режиссера,
+~3.4 актера, ~1.6 сценариста и ~2.2 жанра из 26, персон ~4.2 на фильм.
+Популярность персон неравномерная: небольшая часть персон участвует в
+тысячах фильмов, что дает реалистичный fan-out при изменении person.
+
+Запуск из каталога app (подключение берется из DB_* в .env):
+    python benchmarks/catalogue.py --films 100000 --truncate
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import dsn  # noqa: E402
+
+NAMESPACE = uuid5(NAMESPACE_URL, "etl-benchmark")
+PERSONS_PER_FILM = 4.2
+GENRES = (
+    "Action",
+    "Adventure",
+    "Animation",
+    "Biography",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Family",
+    "Fantasy",
+    "Film-Noir",
+    "Game-Show",
+    "History",
+    "Horror",
+    "Music",
+    "Musical",
+    "Mystery",
+    "News",
+    "Reality-TV",
+    "Romance",
+    "Sci-Fi",
+    "Short",
+    "Sport",
+    "Talk-Show",
+    "Thriller",
+    "War",
+)
+# роль: (возможные количества на фильм, их веса)
+CREDITS = {
+    "director": ((0, 1, 2), (0.22, 0.74, 0.04)),
+    "actor": ((0, 1, 2, 3, 4, 5, 6), (0.1, 0.1, 0.1, 0.15, 0.25, 0.2, 0.1)),
+    "writer": ((0, 1, 2, 3), (0.15, 0.3, 0.4, 0.15)),
+}
+GENRES_PER_FILM = ((1, 2, 3), (0.3, 0.2, 0.5))
+
+SCHEMA = """
+CREATE SCHEMA IF NOT EXISTS content;
+CREATE TABLE IF NOT EXISTS content.film_work (
+    id uuid PRIMARY KEY,
+    title text NOT NULL,
+    description text,
+    creation_date date,
+    rating double precision,
+    type text NOT NULL,
+    created timestamp without time zone,
+    modified timestamp without time zone
+);
+CREATE TABLE IF NOT EXISTS content.genre (
+    id uuid PRIMARY KEY,
+    name text NOT NULL,
+    description text,
+    created timestamp without time zone,
+    modified timestamp without time zone
+);
+CREATE TABLE IF NOT EXISTS content.genre_film_work (
+    id uuid PRIMARY KEY,
+    genre_id uuid NOT NULL,
+    film_work_id uuid NOT NULL,
+    created timestamp without time zone
+);
+CREATE TABLE IF NOT EXISTS content.person (
+    id uuid PRIMARY KEY,
+    full_name text NOT NULL,
+    created timestamp without time zone,
+    modified timestamp without time zone
+);
+CREATE TABLE IF NOT EXISTS content.person_film_work (
+    id uuid PRIMARY KEY,
+    person_id uuid NOT NULL,
+    film_work_id uuid NOT NULL,
+    role text NOT NULL,
+    created timestamp without time zone
+);
+CREATE INDEX IF NOT EXISTS film_work_modified_idx ON content.film_work (modified, id);
+CREATE INDEX IF NOT EXISTS genre_modified_idx ON content.genre (modified, id);
+CREATE INDEX IF NOT EXISTS person_modified_idx ON content.person (modified, id);
+"""
+
+
+def make_id(kind: str, number: int) -> UUID:
+    """Функция возвращает детерминированный айдишник, одинаковый между запусками.
+
+    Args:
+        kind (str): Тип объекта.
+        number (int): Номер объекта.
+
+    Returns:
+        UUID: Айдишник.
+    """
+    return uuid5(NAMESPACE, f"{kind}:{number}")
+
+
+def popular_person(rnd: random.Random, persons: int) -> int:
+    """Функция выбирает номер персоны, отдавая предпочтение первым номерам."""
+    return int(persons * rnd.random() ** 3)
+
+
+def popular_persons(rnd: random.Random, persons: int, amount: int) -> set[int]:
+    """Функция выбирает разные номера персон для одной роли в фильме:
+        в схеме уникальна тройка (фильм, персона, роль).
+
+    Args:
+        rnd (random.Random): Генератор.
+        persons (int): Количество персон.
+        amount (int): Сколько персон выбрать.
+
+    Returns:
+        set[int]: Номера персон.
+    """
+    chosen = set()
+    amount = min(amount, persons)
+    while len(chosen) < amount:
+        chosen.add(popular_person(rnd, persons))
+    return chosen
+
+
+def generate(conn: psycopg.Connection, films: int, seed: int = 0) -> dict:
+    """Функция заполняет схему content синтетическим каталогом через COPY,
+        не собирая строки в памяти.
+
+    Args:
+        conn (psycopg.Connection): Подключение к базе данных.
+        films (int): Количество фильмов.
+        seed (int, optional): Начальное значение генератора. Defaults to 0.
+
+    Returns:
+        dict: Количество строк по таблицам.
+    """
+    rnd = random.Random(seed)
+    persons = max(1, int(films * PERSONS_PER_FILM))
+    started = datetime(2021, 6, 16, 20, 14, 9)
+    counts = dict.fromkeys(
+        ("film_work", "genre", "person", "genre_film_work", "person_film_work"), 0
+    )
+    with conn.cursor() as cursor:
+        with cursor.copy(
+            "COPY content.genre (id, name, description, created, modified) FROM STDIN"
+        ) as copy:
+            for number, name in enumerate(GENRES):
+                created = started + timedelta(microseconds=number)
+                copy.write_row((make_id("genre", number), name, None, created, created))
+                counts["genre"] += 1
+        with cursor.copy(
+            "COPY content.person (id, full_name, created, modified) FROM STDIN"
+        ) as copy:
+            for number in range(persons):
+                created = started + timedelta(microseconds=number)
+                copy.write_row(
+                    (make_id("person", number), f"Person {number}", created, created)
+                )
+                counts["person"] += 1
+        with cursor.copy(
+            "COPY content.film_work (id, title, description, creation_date, rating,"
+            " type, created, modified) FROM STDIN"
+        ) as copy:
+            for number in range(films):
+                created = started + timedelta(microseconds=number)
+                copy.write_row(
+                    (
+                        make_id("film_work", number),
+                        f"Film {number}",
+                        f"Description of film {number}",
+                        None,
+                        round(rnd.uniform(1, 10), 1),
+                        "movie",
+                        created,
+                        created,
+                    )
+                )
+                counts["film_work"] += 1
+        with cursor.copy(
+            "COPY content.person_film_work (id, person_id, film_work_id, role, created)"
+            " FROM STDIN"
+        ) as copy:
+            for number in range(films):
+                film_id = make_id("film_work", number)
+                for role, (amounts, weights) in CREDITS.items():
+                    amount = rnd.choices(amounts, weights)[0]
+                    for person in popular_persons(rnd, persons, amount):
+                        copy.write_row(
+                            (
+                                make_id("person_film_work", counts["person_film_work"]),
+                                make_id("person", person),
+                                film_id,
+                                role,
+                                started,
+                            )
+                        )
+                        counts["person_film_work"] += 1
+        with cursor.copy(
+            "COPY content.genre_film_work (id, genre_id, film_work_id, created)"
+            " FROM STDIN"
+        ) as copy:
+            for number in range(films):
+                film_id = make_id("film_work", number)
+                amount = rnd.choices(*GENRES_PER_FILM)[0]
+                for genre in rnd.sample(range(len(GENRES)), amount):
+                    copy.write_row(
+                        (
+                            make_id("genre_film_work", counts["genre_film_work"]),
+                            make_id("genre", genre),
+                            film_id,
+                            started,
+                        )
+                    )
+                    counts["genre_film_work"] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--films", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="очистить таблицы content перед загрузкой",
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with psycopg.connect(**dsn) as conn:
+        conn.execute(SCHEMA)
+        if args.truncate:
+            conn.execute(
+                "TRUNCATE content.film_work, content.genre, content.genre_film_work,"
+                " content.person, content.person_film_work"
+            )
+        counts = generate(conn, args.films, args.seed)
+        conn.execute("ANALYZE")
+    print(counts, f"{time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
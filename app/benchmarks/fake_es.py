@@ -0,0 +1,144 @@
+"""Поддельный Elasticsearch для бенчмарков: принимает запросы bulk в
+отдельном потоке этого же процесса, ничего не индексирует и считает
+запросы, документы и байты. Чтобы на loopback была видна цена передачи
+данных, сервер может задерживать ответ на время передачи тела запроса
+по каналу заданной пропускной способности, а также отвечать 413 на
+тела больше max_content_length, как http.max_content_length в ES.
+"""
+
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INFO = {
+    "name": "fake-es",
+    "cluster_name": "benchmark",
+    "version": {"number": "7.17.9", "build_flavor": "default"},
+    "tagline": "You Know, for Search",
+}
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.transfer(len(body))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _reply(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _handle(self):
+        body = self._read_body()
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/_bulk"):
+            limit = self.server.max_content_length
+            if limit and len(body) > limit:
+                self._reply({"error": "request entity too large"}, 413)
+            else:
+                self._reply(self.server.handle_bulk(body))
+        elif "wait_for_completion=false" in self.path:
+            self._reply({"task": "fake-node:1"})
+        elif path.startswith("/_tasks/"):
+            self._reply(
+                {
+                    "completed": True,
+                    "task": {},
+                    "response": {"updated": 0, "version_conflicts": 0},
+                }
+            )
+        elif path == "/":
+            self._reply(INFO)
+        else:
+            self._reply({"acknowledged": True})
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _handle
+
+
+class FakeElasticsearch(ThreadingHTTPServer):
+    """HTTP-сервер, отвечающий на bulk успехом для каждого документа."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        bandwidth: int = 0,
+        max_content_length: int = 0,
+    ):
+        super().__init__((host, port), FakeElasticsearchHandler)
+        self.bandwidth = bandwidth
+        self.max_content_length = max_content_length
+        self.lock = threading.Lock()
+        self.bulk_requests = 0
+        self.documents = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def transfer(self, size: int) -> None:
+        """Функция учитывает тело запроса в том виде, в котором оно пришло
+            по сети, и при заданной пропускной способности ждет время его
+            передачи.
+
+        Args:
+            size (int): Размер тела запроса в байтах.
+        """
+        with self.lock:
+            self.wire_bytes += size
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def handle_bulk(self, body: bytes) -> dict:
+        """Функция разбирает тело bulk (пары строк действие - документ)
+            и возвращает успешный ответ по каждому документу.
+
+        Args:
+            body (bytes): Тело запроса в NDJSON.
+
+        Returns:
+            dict: Ответ bulk.
+        """
+        lines = [line for line in body.split(b"\n") if line]
+        items = []
+        for action_line in lines[::2]:
+            action, meta = next(iter(json.loads(action_line).items()))
+            items.append({action: {"_id": meta.get("_id"), "status": 201}})
+        with self.lock:
+            self.bulk_requests += 1
+            self.documents += len(items)
+            self.bytes += len(body)
+        return {"took": 0, "errors": False, "items": items}
+
+    def start(self) -> "FakeElasticsearch":
+        """Функция запускает сервер в фоновом потоке."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "bulk_requests": self.bulk_requests,
+                "documents": self.documents,
+                "bytes": self.bytes,
+                "wire_bytes": self.wire_bytes,
+            }
@@ -0,0 +1,119 @@
+"""Бенчмарк загрузчика: одни и те же документы загружаются в поддельный
+Elasticsearch без сжатия и со сжатием тел запросов (ES_HTTP_COMPRESS).
+Выводятся байты по сети, время загрузки и перцентили длительности
+запросов bulk. Параметр --bandwidth ограничивает пропускную способность
+канала поддельного сервера, чтобы на loopback была видна цена передачи.
+
+Запуск из каталога app:
+    python benchmarks/loader_bench.py --films 2000 --bandwidth 1250000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_es import FakeElasticsearch  # noqa: E402
+from transform_bench import generate_rows  # noqa: E402
+
+
+def count_requests(loader, latencies: list) -> None:
+    """Функция оборачивает client.bulk загрузчика, чтобы записывать
+        длительность каждого запроса.
+
+    Args:
+        loader (ElasticSearchLoader): Загрузчик.
+        latencies (list): Список, в который добавляются длительности.
+    """
+    bulk = loader.client.bulk
+
+    def timed_bulk(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return bulk(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    loader.client.bulk = timed_bulk
+
+
+def run_variant(fake_es: FakeElasticsearch, documents: dict, compress: bool) -> dict:
+    """Функция загружает документы новым загрузчиком с заданным сжатием.
+
+    Args:
+        fake_es (FakeElasticsearch): Поддельный сервер.
+        documents (dict): Документы для загрузки.
+        compress (bool): Сжимать тела запросов.
+
+    Returns:
+        dict: Байты по сети, время загрузки и перцентили запросов в мс.
+    """
+    from elasticsearch_class import ElasticSearchLoader
+
+    os.environ["ES_HTTP_COMPRESS"] = str(compress).lower()
+    loader = ElasticSearchLoader()
+    latencies = []
+    count_requests(loader, latencies)
+    before = fake_es.stats()
+    started = time.perf_counter()
+    loader.bulk_insert_data(documents)
+    elapsed = time.perf_counter() - started
+    after = fake_es.stats()
+    latencies.sort()
+    return {
+        "requests": after["bulk_requests"] - before["bulk_requests"],
+        "wire_bytes": after["wire_bytes"] - before["wire_bytes"],
+        "bytes": after["bytes"] - before["bytes"],
+        "elapsed_s": round(elapsed, 3),
+        **{
+            f"p{percent}_ms": round(
+                latencies[min(len(latencies) - 1, len(latencies) * percent // 100)]
+                * 1000,
+                3,
+            )
+            for percent in (50, 95)
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--films", type=int, default=2000)
+    parser.add_argument("--credits", type=int, default=20)
+    parser.add_argument(
+        "--bandwidth",
+        type=int,
+        default=0,
+        help="пропускная способность канала, байт/с; 0 - без ограничения",
+    )
+    args = parser.parse_args()
+
+    fake_es = FakeElasticsearch(bandwidth=args.bandwidth).start()
+    os.environ["ES_HOST"] = "127.0.0.1"
+    os.environ["ES_PORT"] = str(fake_es.port)
+    os.environ["ES_FINGERPRINT_FILE"] = ""
+    os.environ.setdefault("ES_INDEX", "movies")
+    os.environ.setdefault("ES_SCHEMA", "schema.json")
+
+    from main import Transform
+
+    documents = Transform().prepare_data(generate_rows(args.films, args.credits, 1))
+    print(
+        f"документов: {len(documents)}, режим: {os.environ.get('ES_BULK_MODE', 'bulk')}"
+    )
+    for compress in (False, True):
+        result = run_variant(fake_es, documents, compress)
+        print(
+            f"http_compress={compress!s:<5} запросов: {result['requests']:>4}"
+            f"  по сети: {result['wire_bytes'] / 1024:>10,.0f} КиБ"
+            f" (без сжатия {result['bytes'] / 1024:,.0f} КиБ)"
+            f"  время: {result['elapsed_s']:>7.3f} с"
+            f"  p50: {result['p50_ms']:>8.3f} мс  p95: {result['p95_ms']:>8.3f} мс"
+        )
+    fake_es.shutdown()
+
+
+if __name__ == "__main__":
+    main()
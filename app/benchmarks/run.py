@@ -0,0 +1,206 @@
+"""Сквозной бенчмарк ETL: EtlProcess.universal_process выполняется на
+локальном Postgres (каталог из benchmarks/catalogue.py) и поддельном
+Elasticsearch в этом же процессе. Стадии замеряются обертками над
+методами процесса, поэтому бенчмарк выполняет тот же код, что и сервис.
+Результат выводится в JSON, чтобы сравнивать запуски.
+
+Запуск из каталога app:
+    python benchmarks/catalogue.py --films 100000 --truncate
+    python benchmarks/run.py --tables film_work person --output result.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_es import FakeElasticsearch  # noqa: E402
+
+
+class Recorder:
+    """Замеры длительности стадий и количества обращений к Postgres."""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.postgres_round_trips = 0
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage].append(time.perf_counter() - started)
+
+    def wrap(self, owner, method_name: str, stage: str) -> None:
+        """Функция заменяет метод объекта оберткой, замеряющей его вызовы.
+
+        Args:
+            owner (object): Объект с методом.
+            method_name (str): Название метода.
+            stage (str): Название стадии.
+        """
+        method = getattr(owner, method_name)
+
+        def timed_method(*args, **kwargs):
+            with self.timed(stage):
+                return method(*args, **kwargs)
+
+        setattr(owner, method_name, timed_method)
+
+    def instrument(self, etl) -> None:
+        """Функция оборачивает методы стадий EtlProcess.
+
+        Args:
+            etl (EtlProcess): Процесс ETL.
+        """
+        for extractor in etl.extractors.values():
+            self.wrap(extractor, "extract_data", "extract")
+            # список связанных фильмов есть только у person и genre
+            if hasattr(extractor, "get_movies_list"):
+                self.wrap(extractor, "get_movies_list", "fan_out")
+            self.wrap(extractor, "get_movies_data", "denormalize")
+            self.wrap(extractor, "get_movies_data_batches", "denormalize")
+        self.wrap(etl, "transform_movies", "transform")
+        self.wrap(etl.es_loader, "bulk_insert_stream", "load")
+        self.count_round_trips(etl.db)
+
+    def count_round_trips(self, database):
+        """Функция оборачивает методы Database, чтобы считать обращения
+            к Postgres. Запросы одного pipeline считаются за одно обращение.
+
+        Args:
+            database (Database): Объект базы данных процесса.
+        """
+        make_query = database.make_query
+        make_queries = database.make_queries
+
+        def counted_query(*args, **kwargs):
+            self.postgres_round_trips += 1
+            return make_query(*args, **kwargs)
+
+        def counted_queries(queries, *args, **kwargs):
+            # без pipeline make_queries выполняет запросы через make_query
+            if len(queries) > 1 and psycopg.Pipeline.is_supported():
+                self.postgres_round_trips += 1
+            return make_queries(queries, *args, **kwargs)
+
+        database.make_query = counted_query
+        database.make_queries = counted_queries
+
+    def stages(self) -> dict:
+        """Функция считает перцентили длительности по стадиям.
+
+        Returns:
+            dict: Количество вызовов, суммарное время и перцентили в мс.
+        """
+        result = {}
+        for stage, timings in self.timings.items():
+            timings = sorted(timings)
+            result[stage] = {
+                "count": len(timings),
+                "total_s": round(sum(timings), 3),
+                **{
+                    f"p{percent}_ms": round(
+                        timings[min(len(timings) - 1, len(timings) * percent // 100)]
+                        * 1000,
+                        3,
+                    )
+                    for percent in (50, 95, 99)
+                },
+            }
+        return result
+
+
+def run_table(etl, table_name: str) -> int:
+    """Функция прогоняет все изменения таблицы через universal_process.
+        Состояние пишется во временный файл, поэтому каждый запуск
+        начинается с начала таблицы.
+
+    Args:
+        etl (EtlProcess): Процесс ETL.
+        table_name (str): Название таблицы.
+
+    Returns:
+        int: Количество обработанных строк таблицы.
+    """
+    etl.start_cycle()
+    return etl.universal_process(table_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=["film_work"],
+        choices=["film_work", "person", "genre"],
+    )
+    parser.add_argument("--output", help="файл для результата, по умолчанию stdout")
+    args = parser.parse_args()
+
+    fake_es = FakeElasticsearch().start()
+    workdir = tempfile.mkdtemp(prefix="etl-bench-")
+    os.environ["ES_HOST"] = "127.0.0.1"
+    os.environ["ES_PORT"] = str(fake_es.port)
+    os.environ["STATE_FILE"] = os.path.join(workdir, "state.json")
+    os.environ["STATE_BACKEND"] = "json"
+    os.environ["ES_FINGERPRINT_FILE"] = ""
+    os.environ.setdefault("LIMIT", "100")
+    os.environ.setdefault("ES_INDEX", "movies")
+    os.environ.setdefault("ES_SCHEMA", "schema.json")
+
+    from main import EtlProcess, config
+
+    recorder = Recorder()
+    etl = EtlProcess()
+    recorder.instrument(etl)
+    started = time.perf_counter()
+    rows = {table_name: run_table(etl, table_name) for table_name in args.tables}
+    elapsed = time.perf_counter() - started
+    etl.db.close_connection()
+    documents = fake_es.stats()["documents"]
+
+    report = {
+        "tables": args.tables,
+        "config": {
+            "limit": config.extractor.limit,
+            "extract_mode": config.extractor.mode,
+            "pipeline_depth": config.extractor.pipeline_depth,
+            "bulk_mode": config.elasticsearch.bulk_mode,
+            "bulk_chunk_size": config.elasticsearch.bulk_chunk_size,
+        },
+        "rows": rows,
+        "documents": documents,
+        "elapsed_s": round(elapsed, 3),
+        "docs_per_sec": round(documents / elapsed, 1) if elapsed else 0,
+        "stages": recorder.stages(),
+        "round_trips": {
+            "postgres": recorder.postgres_round_trips,
+            "elasticsearch": fake_es.stats()["bulk_requests"],
+        },
+        "elasticsearch": fake_es.stats(),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+    fake_es.shutdown()
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
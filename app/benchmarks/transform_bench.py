@@ -0,0 +1,137 @@
+"""Микробенчмарк трансформации строк join-запроса в документы ES.
+
+Запуск из каталога app: python benchmarks/transform_bench.py --films 200 --credits 300
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Transform  # noqa: E402
+
+ROLES = ("director", "actor", "writer")
+COLUMNS = (
+    "fw_id",
+    "title",
+    "description",
+    "rating",
+    "role",
+    "id",
+    "full_name",
+    "name",
+)
+
+
+def generate_rows(films: int, credits: int, genres: int, seed: int = 0) -> list:
+    """Функция генерирует строки в том виде, в котором их возвращает
+        _movies_data_statement: по строке на каждую пару персона - жанр фильма.
+
+    Args:
+        films (int): Количество фильмов.
+        credits (int): Количество персон в фильме.
+        genres (int): Количество жанров в фильме.
+        seed (int, optional): Начальное значение генератора. Defaults to 0.
+
+    Returns:
+        list: Строки-кортежи.
+    """
+    rnd = random.Random(seed)
+    genre_names = [f"genre {number}" for number in range(50)]
+    rows = []
+    for number in range(films):
+        film = (
+            str(uuid4()),
+            f"Film {number}",
+            f"Description {number}",
+            round(rnd.uniform(0, 10), 1),
+        )
+        persons = [
+            (rnd.choice(ROLES), str(uuid4()), f"Person {rnd.randrange(credits * 2)}")
+            for _ in range(credits)
+        ]
+        film_genres = rnd.sample(genre_names, genres)
+        for person in persons:
+            for genre in film_genres:
+                rows.append((*film, *person, genre))
+    return rows
+
+
+def legacy_prepare_data(data: list) -> dict:
+    """Исходная реализация Transform.prepare_data на строках-словарях,
+    используется как точка отсчета.
+    """
+    result = {}
+    for row in data:
+        current_movie = result.setdefault(str(row["fw_id"]), {})
+        if not current_movie:
+            current_movie["id"] = str(row["fw_id"])
+            current_movie["title"] = str(row["title"])
+            current_movie["description"] = str(row["description"])
+            current_movie["imdb_rating"] = row["rating"] or 0
+            current_movie["title"] = str(row["title"])
+            current_movie["description"] = str(row["description"])
+            for role in ("directors", "actors", "writers"):
+                current_movie[role] = []
+                current_movie[f"{role}_names"] = []
+        genres = current_movie.setdefault("genres", [])
+        if row["name"] not in genres:
+            genres.append(str(row["name"]))
+        role = row["role"]
+        for name, field in (
+            ("director", "directors"),
+            ("actor", "actors"),
+            ("writer", "writers"),
+        ):
+            if role == name:
+                names = current_movie.setdefault(f"{field}_names", [])
+                if str(row["full_name"]) not in names:
+                    names.append(str(row["full_name"]))
+                    current_movie.setdefault(field, []).append(
+                        dict(id=str(row["id"]), name=str(row["full_name"]))
+                    )
+    return result
+
+
+def measure(func, data: list, repeat: int) -> float:
+    """Функция возвращает лучшее время выполнения из repeat запусков."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--films", type=int, default=100)
+    parser.add_argument("--credits", type=int, default=300)
+    parser.add_argument("--genres", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.films, args.credits, args.genres)
+    dict_rows = [dict(zip(COLUMNS, row)) for row in rows]
+    transform = Transform()
+
+    new_result = transform.prepare_data(rows)
+    legacy_result = legacy_prepare_data(dict_rows)
+    for movie_id, document in legacy_result.items():
+        assert new_result[movie_id] == document, movie_id
+
+    print(f"строк: {len(rows)}, фильмов: {args.films}")
+    for name, func, data in (
+        ("legacy (dict_row)", legacy_prepare_data, dict_rows),
+        ("prepare_data (tuple_row)", transform.prepare_data, rows),
+    ):
+        elapsed = measure(func, data, args.repeat)
+        print(f"{name:<26} {len(rows) / elapsed:>12,.0f} строк/с")
+
+
+if __name__ == "__main__":
+    main()
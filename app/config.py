@@ -11,6 +11,11 @@ class Postgres:
     db_name: str
     user: str
     password: str
+    pool_min_size: int
+    pool_max_size: int
+    pool_timeout: float
+    pool_max_idle: float
+    prepare: bool | None
 
 
 @dataclass
@@ -19,16 +24,86 @@ class Elasticsearch:
     host: str
     port: str
     file_schema: str
+    number_of_replicas: int
+    bulk_mode: str
+    bulk_threads: int
+    bulk_chunk_size: int
+    bulk_max_chunk_bytes: int
+    bulk_max_retries: int
+    bulk_initial_backoff: float
+    fingerprint_file: str | None
+    http_compress: bool
+    maxsize: int
+    timeout: float
+    retry_on_timeout: bool
+    max_retries: int
 
 
 @dataclass
 class State:
     file_name: str
+    backend: str
+    cached: bool
+    flush_batches: int
+    flush_interval: float
+
+
+@dataclass
+class Redis:
+    host: str
+    port: int
+    db: int
+    state_key: str
 
 
 @dataclass
 class Extractor:
     limit: int
+    mode: str
+    stream: bool
+    itersize: int
+    pipeline_depth: int
+    partial_updates: bool
+
+
+@dataclass
+class Pipeline:
+    queue_size: int
+
+
+@dataclass
+class Shard:
+    index: int
+    count: int
+
+
+@dataclass
+class Listener:
+    catch_up_interval: float
+    debounce: float
+
+
+@dataclass
+class Adaptive:
+    enabled: bool
+    limit_min: int
+    limit_max: int
+    chunk_min: int
+    chunk_max: int
+    limit_seconds: float
+    chunk_seconds: float
+
+
+@dataclass
+class Snapshot:
+    file_name: str
+    compress_level: int
+
+
+@dataclass
+class Metrics:
+    port: int
+    profile_dir: str | None
 
 
 @dataclass
@@ -41,7 +116,14 @@ class Config:
     postgres: Postgres
     elasticsearch: Elasticsearch
     state: State
+    redis: Redis
     extractor: Extractor
+    pipeline: Pipeline
+    shard: Shard
+    listener: Listener
+    adaptive: Adaptive
+    snapshot: Snapshot
+    metrics: Metrics
     logger: Logger
 
 
@@ -60,18 +142,88 @@ def load_config(path: str = "./.env") -> Config:
             db_name=os.environ.get("DB_NAME"),
             user=os.environ.get("DB_USER"),
             password=os.environ.get("DB_PASSWORD"),
+            pool_min_size=int(os.environ.get("DB_POOL_MIN_SIZE", 1)),
+            pool_max_size=int(os.environ.get("DB_POOL_MAX_SIZE", 3)),
+            pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            pool_max_idle=float(os.environ.get("DB_POOL_MAX_IDLE", 600)),
+            prepare=os.environ.get("DB_PREPARE", "false").lower()
+            in ("1", "true", "yes")
+            or None,
         ),
         elasticsearch=Elasticsearch(
             index_name=os.environ.get("ES_INDEX"),
             host=os.environ.get("ES_HOST", "127.0.0.1"),
             port=os.environ.get("ES_PORT", 9200),
             file_schema=os.environ.get("ES_SCHEMA"),
+            number_of_replicas=int(os.environ.get("ES_NUMBER_OF_REPLICAS", 1)),
+            bulk_mode=os.environ.get("ES_BULK_MODE", "bulk"),
+            bulk_threads=int(os.environ.get("ES_BULK_THREADS", 4)),
+            bulk_chunk_size=int(os.environ.get("ES_BULK_CHUNK_SIZE", 500)),
+            bulk_max_chunk_bytes=int(
+                os.environ.get("ES_BULK_MAX_CHUNK_BYTES", 100 * 1024 * 1024)
+            ),
+            bulk_max_retries=int(os.environ.get("ES_BULK_MAX_RETRIES", 3)),
+            bulk_initial_backoff=float(os.environ.get("ES_BULK_INITIAL_BACKOFF", 2)),
+            fingerprint_file=os.environ.get("ES_FINGERPRINT_FILE") or None,
+            http_compress=os.environ.get("ES_HTTP_COMPRESS", "false").lower()
+            in ("1", "true", "yes"),
+            maxsize=int(os.environ.get("ES_MAXSIZE", 0)),
+            timeout=float(os.environ.get("ES_TIMEOUT", 30)),
+            retry_on_timeout=os.environ.get("ES_RETRY_ON_TIMEOUT", "false").lower()
+            in ("1", "true", "yes"),
+            max_retries=int(os.environ.get("ES_MAX_RETRIES", 3)),
         ),
         state=State(
             file_name=os.environ.get("STATE_FILE"),
+            backend=os.environ.get("STATE_BACKEND", "json"),
+            cached=os.environ.get("STATE_CACHED", "false").lower()
+            in ("1", "true", "yes"),
+            flush_batches=int(os.environ.get("STATE_FLUSH_BATCHES", 10)),
+            flush_interval=float(os.environ.get("STATE_FLUSH_INTERVAL", 5)),
+        ),
+        redis=Redis(
+            host=os.environ.get("REDIS_HOST", "127.0.0.1"),
+            port=int(os.environ.get("REDIS_PORT", 6379)),
+            db=int(os.environ.get("REDIS_DB", 0)),
+            state_key=os.environ.get("REDIS_STATE_KEY", "etl:state"),
         ),
         extractor=Extractor(
-            limit=os.environ.get("LIMIT"),
+            limit=int(os.environ.get("LIMIT", 100)),
+            mode=os.environ.get("EXTRACT_MODE", "join"),
+            stream=os.environ.get("STREAM", "false").lower() in ("1", "true", "yes"),
+            itersize=int(os.environ.get("ITERSIZE", 100)),
+            pipeline_depth=int(os.environ.get("EXTRACT_PIPELINE_DEPTH", 4)),
+            partial_updates=os.environ.get("EXTRACT_PARTIAL_UPDATES", "false").lower()
+            in ("1", "true", "yes"),
+        ),
+        pipeline=Pipeline(
+            queue_size=int(os.environ.get("PIPELINE_QUEUE_SIZE", 4)),
+        ),
+        shard=Shard(
+            index=int(os.environ.get("SHARD_INDEX", 0)),
+            count=int(os.environ.get("SHARD_COUNT", 1)),
+        ),
+        listener=Listener(
+            catch_up_interval=float(os.environ.get("LISTEN_CATCH_UP_INTERVAL", 30)),
+            debounce=float(os.environ.get("LISTEN_DEBOUNCE", 0.5)),
+        ),
+        adaptive=Adaptive(
+            enabled=os.environ.get("ADAPTIVE_BATCHES", "false").lower()
+            in ("1", "true", "yes"),
+            limit_min=int(os.environ.get("ADAPTIVE_LIMIT_MIN", 50)),
+            limit_max=int(os.environ.get("ADAPTIVE_LIMIT_MAX", 5000)),
+            chunk_min=int(os.environ.get("ADAPTIVE_CHUNK_MIN", 50)),
+            chunk_max=int(os.environ.get("ADAPTIVE_CHUNK_MAX", 5000)),
+            limit_seconds=float(os.environ.get("ADAPTIVE_LIMIT_SECONDS", 5)),
+            chunk_seconds=float(os.environ.get("ADAPTIVE_CHUNK_SECONDS", 1)),
+        ),
+        snapshot=Snapshot(
+            file_name=os.environ.get("SNAPSHOT_FILE", "snapshot.ndjson.gz"),
+            compress_level=int(os.environ.get("SNAPSHOT_COMPRESS_LEVEL", 1)),
+        ),
+        metrics=Metrics(
+            port=int(os.environ.get("METRICS_PORT", 0)),
+            profile_dir=os.environ.get("PROFILE_DIR") or None,
         ),
         logger=Logger(file_name=os.environ.get("LOGGER_FILE", None)),
     )
@@ -1,21 +1,136 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator
+
 import elasticsearch
-from backoff import backoff
+import orjson
+from backoff import async_backoff, backoff
 from config import load_config
 from elasticsearch import helpers
-from elasticsearch.exceptions import RequestError
+from elasticsearch.exceptions import RequestError, TransportError
+from fingerprint import get_fingerprints
 from main_logger import MainLogger
+from metrics import BULK_BYTES, BULK_DOCUMENTS, BULK_ERRORS, async_timed, timed
 
 logger = MainLogger().get_logger("elastic")
 
+PARALLEL_BULK = "parallel"
+RAW_BULK = "raw"
+
+PERSON_ROLES = ("directors", "actors", "writers")
+# интервал опроса фоновых задач ES (force merge), секунды
+TASK_POLL_INTERVAL = 5
+
+UPDATE_PERSONS_SCRIPT = """
+for (def role : params.roles) {
+    def persons = ctx._source[role];
+    if (persons == null) {
+        continue;
+    }
+    def names = [];
+    for (def person : persons) {
+        if (params.persons.containsKey(person.id)) {
+            person.name = params.persons[person.id];
+        }
+        if (!names.contains(person.name)) {
+            names.add(person.name);
+        }
+    }
+    ctx._source[role + '_names'] = names;
+}
+"""
+
+
+@dataclass
+class BulkStats:
+    """Статистика запросов bulk с последнего вызова take_stats."""
+
+    requests: int = 0
+    seconds: float = 0
+    documents: int = 0
+    bytes: int = 0
+    rejections: int = 0
+
 
 class ElasticSearchLoader:
 
-    def __init__(self):
+    def __init__(self, prefix: str = ""):
         self.config = load_config().elasticsearch
         self.index = self.config.index_name
         self.client = elasticsearch.Elasticsearch(
-            f"http://{self.config.host}:{self.config.port}"
+            f"http://{self.config.host}:{self.config.port}", **self._client_options()
         )
+        self.fingerprints = get_fingerprints(self.config.fingerprint_file, prefix)
+        self.chunk_size = self.config.bulk_chunk_size
+        self.stats = BulkStats()
+        self.stats_lock = threading.Lock()
+        # запросы helpers и режима raw проходят через client.bulk, поэтому
+        # замеряется только время ES без чтения и трансформации документов
+        self._client_bulk = self.client.bulk
+        self.client.bulk = self._timed_bulk
+
+    def _timed_bulk(self, *args, **kwargs) -> dict:
+        """Функция выполняет client.bulk и учитывает длительность запроса,
+            количество и размер документов и отказы 413/429 в self.stats.
+
+        Returns:
+            dict: Ответ bulk.
+        """
+        body = kwargs.get("body", args[0] if args else b"")
+        if isinstance(body, str):
+            # helpers передают тело NDJSON строкой
+            body = body.encode()
+        size, lines = len(body), body.count(b"\n")
+        BULK_BYTES.observe(size)
+        started = time.perf_counter()
+        try:
+            return self._client_bulk(*args, **kwargs)
+        except TransportError as error:
+            if error.status_code in (413, 429):
+                self.add_rejection()
+            raise
+        finally:
+            with self.stats_lock:
+                self.stats.requests += 1
+                self.stats.seconds += time.perf_counter() - started
+                self.stats.documents += lines // 2
+                self.stats.bytes += size
+
+    def add_rejection(self) -> None:
+        with self.stats_lock:
+            self.stats.rejections += 1
+
+    def take_stats(self) -> BulkStats:
+        """Функция возвращает статистику запросов bulk и обнуляет ее.
+
+        Returns:
+            BulkStats: Статистика с прошлого вызова.
+        """
+        with self.stats_lock:
+            stats, self.stats = self.stats, BulkStats()
+        return stats
+
+    def _client_options(self) -> dict:
+        """Функция собирает настройки транспорта клиента: сжатие тел
+            запросов, размер пула keep-alive подключений и таймауты.
+            Пул по умолчанию равен количеству потоков загрузки, чтобы
+            параллельные запросы bulk не открывали новые подключения.
+
+        Returns:
+            dict: Именованные аргументы клиента.
+        """
+        return {
+            "http_compress": self.config.http_compress,
+            "maxsize": self.config.maxsize or max(1, self.config.bulk_threads),
+            "timeout": self.config.timeout,
+            "retry_on_timeout": self.config.retry_on_timeout,
+            "max_retries": self.config.max_retries,
+        }
 
     def _load_schema(self) -> str:
         """Функция читает схему из файла
@@ -42,9 +157,161 @@ class ElasticSearchLoader:
             self.client.indices.create(index=self.index, body=schema)
         except RequestError:
             logger.info(
-                f"Пропускаю создание индекса. Индекс с названием уже существует.", self.index
+                f"Пропускаю создание индекса. Индекс с названием уже существует.",
+                self.index,
             )
 
+    @backoff()
+    def start_rebuild(self) -> str:
+        """Функция создает новую версию индекса для полной переиндексации.
+            На время загрузки обновление индекса и реплики отключаются,
+            все последующие вставки идут в новый индекс.
+
+        Returns:
+            str: Название созданного индекса.
+        """
+        schema = json.loads(self._load_schema())
+        settings = schema.setdefault("settings", {})
+        settings["refresh_interval"] = "-1"
+        settings["number_of_replicas"] = 0
+        self.index = f"{self.config.index_name}_{time.strftime('%Y%m%d%H%M%S')}"
+        if self.fingerprints:
+            self.fingerprints.clear()
+        logger.info("Создание индекса для переиндексации: %s", self.index)
+        self.client.indices.create(index=self.index, body=schema)
+        return self.index
+
+    def finish_rebuild(self) -> None:
+        """Функция возвращает настройки индекса после полной переиндексации,
+        объединяет сегменты и атомарно переключает на него алиас.
+        Каждый шаг повторяется при ошибках подключения отдельно, чтобы
+        повтор не запускал заново объединение сегментов.
+        """
+        self._restore_settings()
+        logger.info("Объединение сегментов индекса %s", self.index)
+        self._wait_task(self._start_force_merge())
+        self._switch_alias()
+
+    @backoff()
+    def _restore_settings(self) -> None:
+        settings = json.loads(self._load_schema()).get("settings", {})
+        self.client.indices.put_settings(
+            index=self.index,
+            body={
+                "index": {
+                    "refresh_interval": settings.get("refresh_interval", "1s"),
+                    "number_of_replicas": self.config.number_of_replicas,
+                }
+            },
+        )
+        self.client.indices.refresh(index=self.index)
+
+    @backoff()
+    def _start_force_merge(self) -> str:
+        """Функция запускает объединение сегментов индекса фоновой задачей:
+            на большом индексе оно идет дольше таймаута запроса ES_TIMEOUT.
+
+        Returns:
+            str: Айдишник задачи.
+        """
+        response = self.client.indices.forcemerge(
+            index=self.index,
+            max_num_segments=1,
+            params={"wait_for_completion": "false"},
+        )
+        return response["task"]
+
+    @backoff()
+    def _wait_task(self, task_id: str) -> dict:
+        """Функция ждет завершения фоновой задачи ES.
+
+        Args:
+            task_id (str): Айдишник задачи.
+
+        Returns:
+            dict: Результат задачи (поле response) или пустой словарь.
+        """
+        while not (task := self.client.tasks.get(task_id=task_id))["completed"]:
+            time.sleep(TASK_POLL_INTERVAL)
+        return task.get("response", {})
+
+    @backoff()
+    def _switch_alias(self) -> None:
+        """Функция атомарно переключает алиас на новый индекс. Предыдущие
+        индексы под алиасом (или одноименный индекс) удаляются в том же
+        запросе. Новый индекс не удаляется, даже если при повторе алиас
+        уже указывает на него.
+        """
+        alias = self.config.index_name
+        actions = [{"add": {"index": self.index, "alias": alias}}]
+        if self.client.indices.exists_alias(name=alias):
+            old_indices = self.client.indices.get_alias(name=alias)
+            actions += [
+                {"remove_index": {"index": index}}
+                for index in old_indices
+                if index != self.index
+            ]
+        elif self.client.indices.exists(index=alias):
+            actions.append({"remove_index": {"index": alias}})
+        self.client.indices.update_aliases(body={"actions": actions})
+        logger.info("Алиас %s переключен на индекс %s", alias, self.index)
+        self.index = alias
+
+    def update_persons(self, persons: dict[str, str]) -> dict:
+        """Функция обновляет имена персон во всех фильмах, где они участвуют,
+            скриптом на стороне ES, без повторной загрузки документов.
+            update_by_query видит только документы, доступные для поиска,
+            поэтому индекс перед запросом обновляется (refresh). Запрос
+            выполняется фоновой задачей: у популярной персоны он может идти
+            дольше таймаута запроса ES_TIMEOUT.
+
+        Args:
+            persons (dict[str, str]): Пары айдишник персоны - новое имя.
+
+        Returns:
+            dict: Ответ update_by_query с количеством обновленных документов.
+        """
+        if not persons:
+            return {"updated": 0, "version_conflicts": 0}
+        return self._wait_task(self._start_update_persons(persons))
+
+    @backoff()
+    def _start_update_persons(self, persons: dict[str, str]) -> str:
+        """Функция запускает update_by_query по фильмам персон.
+
+        Args:
+            persons (dict[str, str]): Пары айдишник персоны - новое имя.
+
+        Returns:
+            str: Айдишник задачи.
+        """
+        query = {
+            "bool": {
+                "should": [
+                    {
+                        "nested": {
+                            "path": role,
+                            "query": {"terms": {f"{role}.id": list(persons)}},
+                        }
+                    }
+                    for role in PERSON_ROLES
+                ]
+            }
+        }
+        script = {
+            "source": UPDATE_PERSONS_SCRIPT,
+            "lang": "painless",
+            "params": {"roles": PERSON_ROLES, "persons": persons},
+        }
+        self.client.indices.refresh(index=self.index)
+        response = self.client.update_by_query(
+            index=self.index,
+            body={"query": query, "script": script},
+            conflicts="proceed",
+            wait_for_completion=False,
+        )
+        return response["task"]
+
     def bulk_insert_data(self, data: dict) -> dict:
         """Функция вставляет массово вставляет данные
 
@@ -54,8 +321,226 @@ class ElasticSearchLoader:
         Returns:
             dict: результат выполнения.
         """
-        prepared_data = self.create_statement_bach_insert(data)
-        return helpers.bulk(self.client, prepared_data, index=self.index)
+        return self.bulk_insert_stream(data.items())
+
+    @timed("load")
+    def bulk_insert_stream(self, documents: Iterable[tuple[str, dict]]) -> tuple:
+        """Функция массово вставляет документы по мере их поступления,
+            не собирая их в список.
+
+        Args:
+            documents (Iterable[tuple[str, dict]]): Пары айдишник - документ.
+
+        Returns:
+            tuple: Количество вставленных документов и список ошибок.
+        """
+        pending = {}
+        if self.fingerprints:
+            documents = self.fingerprints.filter_changed(documents, pending)
+        actions = self.generate_statement_bach_insert(documents)
+        try:
+            if self.config.bulk_mode == RAW_BULK:
+                result = self.raw_bulk_insert(documents)
+            elif self.config.bulk_mode == PARALLEL_BULK:
+                result = self.parallel_bulk_insert(actions)
+            else:
+                result = helpers.bulk(
+                    self.client, actions, index=self.index, **self._bulk_options()
+                )
+        except helpers.BulkIndexError as error:
+            BULK_ERRORS.inc(len(error.errors))
+            raise
+        if self.fingerprints:
+            self.fingerprints.commit(pending)
+        BULK_DOCUMENTS.observe(result[0])
+        return result
+
+    def parallel_bulk_insert(self, actions: Iterable[dict]) -> tuple:
+        """Функция вставляет документы в несколько потоков. Действия читаются
+            из генератора частями по chunk_size, одновременно в обработке
+            находится не больше 2 * bulk_threads частей. Отклоненные с кодом 429
+            документы повторяются по одному через streaming_bulk.
+
+        Args:
+            actions (Iterable[dict]): Действия для массовой загрузки.
+
+        Raises:
+            BulkIndexError: Часть документов не удалось вставить.
+
+        Returns:
+            tuple: Количество вставленных документов и список ошибок.
+        """
+        success, errors = 0, []
+        in_flight = deque()
+        actions = iter(actions)
+        with ThreadPoolExecutor(max_workers=self.config.bulk_threads) as executor:
+            while chunk := list(islice(actions, self.chunk_size)):
+                in_flight.append(executor.submit(self._insert_chunk, chunk))
+                if len(in_flight) >= 2 * self.config.bulk_threads:
+                    chunk_success, chunk_errors = in_flight.popleft().result()
+                    success += chunk_success
+                    errors.extend(chunk_errors)
+            for future in in_flight:
+                chunk_success, chunk_errors = future.result()
+                success += chunk_success
+                errors.extend(chunk_errors)
+        if errors:
+            raise helpers.BulkIndexError(
+                "%i document(s) failed to index." % len(errors), errors
+            )
+        return success, errors
+
+    def raw_bulk_insert(self, documents: Iterable[tuple[str, dict]]) -> tuple:
+        """Функция вставляет документы, заранее закодированные в NDJSON через
+            orjson, и отправляет тело запроса в client.bulk байтами. Каждый
+            документ кодируется один раз, при повторе после ответа 429
+            отправляются те же байты.
+
+        Args:
+            documents (Iterable[tuple[str, dict]]): Пары айдишник - документ.
+
+        Raises:
+            BulkIndexError: Часть документов не удалось вставить.
+
+        Returns:
+            tuple: Количество вставленных документов и список ошибок.
+        """
+        success, errors = 0, []
+        chunk, chunk_bytes = [], 0
+        for _id, document in documents:
+            encoded = self._encode_action(_id, document)
+            if chunk and (
+                len(chunk) >= self.chunk_size
+                or chunk_bytes + len(encoded) > self.config.bulk_max_chunk_bytes
+            ):
+                chunk_success, chunk_errors = self._send_raw_chunk(chunk)
+                success += chunk_success
+                errors.extend(chunk_errors)
+                chunk, chunk_bytes = [], 0
+            chunk.append(encoded)
+            chunk_bytes += len(encoded)
+        if chunk:
+            chunk_success, chunk_errors = self._send_raw_chunk(chunk)
+            success += chunk_success
+            errors.extend(chunk_errors)
+        if errors:
+            raise helpers.BulkIndexError(
+                "%i document(s) failed to index." % len(errors), errors
+            )
+        return success, errors
+
+    @staticmethod
+    def _encode_action(_id: str, document: dict) -> bytes:
+        """Функция кодирует строку действия и документ в NDJSON.
+
+        Returns:
+            bytes: Две строки NDJSON.
+        """
+        return b"%b\n%b\n" % (
+            orjson.dumps({"index": {"_id": _id}}),
+            orjson.dumps(document, default=str),
+        )
+
+    @backoff()
+    def _send_raw_chunk(self, chunk: list[bytes]) -> tuple:
+        """Функция отправляет часть закодированных действий с повтором
+            при ответе 429 только для отклоненных документов.
+
+        Args:
+            chunk (list[bytes]): Закодированные действия.
+
+        Returns:
+            tuple: Количество вставленных документов и список ошибок.
+        """
+        success, errors = 0, []
+        delay = self.config.bulk_initial_backoff
+        for attempt in range(self.config.bulk_max_retries + 1):
+            body = b"".join(chunk)
+            try:
+                response = self.client.bulk(body=body, index=self.index)
+            except TransportError as error:
+                if error.status_code == 413 and len(chunk) > 1:
+                    # тело запроса слишком большое: часть делится пополам
+                    middle = len(chunk) // 2
+                    first = self._send_raw_chunk(chunk[:middle])
+                    second = self._send_raw_chunk(chunk[middle:])
+                    return (
+                        success + first[0] + second[0],
+                        errors + first[1] + second[1],
+                    )
+                if error.status_code != 429 or attempt == self.config.bulk_max_retries:
+                    raise
+                time.sleep(min(delay, 600))
+                delay *= 2
+                continue
+            if not response["errors"]:
+                return success + len(chunk), errors
+            retry = []
+            for encoded, item in zip(chunk, response["items"]):
+                result = item["index"]
+                if result["status"] < 300:
+                    success += 1
+                elif result["status"] == 429 and attempt < self.config.bulk_max_retries:
+                    retry.append(encoded)
+                else:
+                    errors.append(item)
+            if not retry:
+                break
+            self.add_rejection()
+            time.sleep(min(delay, 600))
+            delay *= 2
+            chunk = retry
+        return success, errors
+
+    def _insert_chunk(self, actions: list[dict]) -> tuple:
+        """Функция вставляет одну часть документов с повтором при 429.
+
+        Args:
+            actions (list[dict]): Действия для массовой загрузки.
+
+        Returns:
+            tuple: Количество вставленных документов и список ошибок.
+        """
+        success, errors = 0, []
+        for ok, item in helpers.streaming_bulk(
+            self.client,
+            actions,
+            index=self.index,
+            raise_on_error=False,
+            **self._bulk_options(),
+        ):
+            if ok:
+                success += 1
+            else:
+                errors.append(item)
+        return success, errors
+
+    def _bulk_options(self) -> dict:
+        """Функция возвращает настройки массовой загрузки из конфига.
+
+        Returns:
+            dict: Аргументы для helpers.bulk/streaming_bulk.
+        """
+        return {
+            "chunk_size": self.chunk_size,
+            "max_chunk_bytes": self.config.bulk_max_chunk_bytes,
+            "max_retries": self.config.bulk_max_retries,
+            "initial_backoff": self.config.bulk_initial_backoff,
+        }
+
+    def generate_statement_bach_insert(
+        self, documents: Iterable[tuple[str, dict]]
+    ) -> Iterator[dict]:
+        """Функция формирует действия для массовой загрузки по одному.
+
+        Args:
+            documents (Iterable[tuple[str, dict]]): Пары айдишник - документ.
+
+        Yields:
+            dict: Действие для массовой загрузки.
+        """
+        for _id, value in documents:
+            yield {"_id": _id, "_index": self.index, "_source": value}
 
     def create_statement_bach_insert(self, data: dict) -> list[dict]:
         """Функция формирует список для загрузки массовой загрузки.
@@ -66,7 +551,63 @@ class ElasticSearchLoader:
         Returns:
             list: Список с измененными значениями
         """
-        prepared_data = []
-        for _id, value in data.items():
-            prepared_data.append({"_id": _id, "_index": self.index, "_source": value})
-        return prepared_data
+        return list(self.generate_statement_bach_insert(data.items()))
+
+
+class AsyncElasticSearchLoader(ElasticSearchLoader):
+    """Загрузчик данных на основе AsyncElasticsearch."""
+
+    def __init__(self, prefix: str = ""):
+        self.config = load_config().elasticsearch
+        self.index = self.config.index_name
+        self.client = elasticsearch.AsyncElasticsearch(
+            f"http://{self.config.host}:{self.config.port}", **self._client_options()
+        )
+        self.fingerprints = get_fingerprints(self.config.fingerprint_file, prefix)
+        self.chunk_size = self.config.bulk_chunk_size
+        self.stats = BulkStats()
+        self.stats_lock = threading.Lock()
+
+    @async_backoff()
+    async def create_index(self) -> None:
+        """Функция создает индекс, если такой индекс уже существует, то
+        пропускает создание.
+        """
+        schema = self._load_schema()
+        try:
+            logger.info(f"Создание индекса: {self.index}")
+            await self.client.indices.create(index=self.index, body=schema)
+        except RequestError:
+            logger.info(
+                "Пропускаю создание индекса. Индекс %s уже существует.", self.index
+            )
+
+    @async_timed("load")
+    async def bulk_insert_data(self, data: dict) -> tuple:
+        """Функция массово вставляет данные через async_streaming_bulk.
+
+        Args:
+            data (dict): Словарь с данными.
+
+        Returns:
+            tuple: Количество вставленных документов и список ошибок.
+        """
+        success, errors = 0, []
+        documents = data.items()
+        pending = {}
+        if self.fingerprints:
+            documents = self.fingerprints.filter_changed(documents, pending)
+        actions = self.generate_statement_bach_insert(documents)
+        async for ok, item in helpers.async_streaming_bulk(
+            self.client, actions, index=self.index, **self._bulk_options()
+        ):
+            if ok:
+                success += 1
+            else:
+                errors.append(item)
+        if self.fingerprints and not errors:
+            self.fingerprints.commit(pending)
+        return success, errors
+
+    async def close(self) -> None:
+        await self.client.close()
@@ -0,0 +1,118 @@
+import dbm
+import json
+from hashlib import blake2b
+from typing import Iterable, Iterator
+
+from main_logger import MainLogger
+
+logger = MainLogger().get_logger("fingerprint")
+
+
+class FingerprintStore:
+    """Хранилище отпечатков документов, загруженных в ES. Отпечаток - хеш
+    документа в каноническом JSON, по нему неизмененные документы
+    отбрасываются перед вставкой.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.db = dbm.open(file_name, "c")
+
+    @staticmethod
+    def fingerprint(document: dict) -> bytes:
+        """Функция считает отпечаток документа. Ключи сортируются, поэтому
+            отпечаток не зависит от порядка полей.
+
+        Args:
+            document (dict): Документ для вставки в ES.
+
+        Returns:
+            bytes: Хеш документа.
+        """
+        canonical = json.dumps(
+            document,
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            default=str,
+        )
+        return blake2b(canonical.encode(), digest_size=16).digest()
+
+    def filter_changed(
+        self, documents: Iterable[tuple[str, dict]], pending: dict
+    ) -> Iterator[tuple[str, dict]]:
+        """Функция отбрасывает документы, совпадающие с уже загруженными.
+            Отпечатки пропущенных дальше документов собираются в pending
+            вызывающего и сохраняются только после успешной вставки вызовом
+            commit, поэтому одновременные вставки не сохраняют чужие отпечатки.
+
+        Args:
+            documents (Iterable[tuple[str, dict]]): Пары айдишник - документ.
+            pending (dict): Словарь для отпечатков пропущенных документов.
+
+        Yields:
+            tuple[str, dict]: Измененные документы.
+        """
+        total = skipped = 0
+        for document_id, document in documents:
+            total += 1
+            fingerprint = self.fingerprint(document)
+            if self.db.get(document_id) == fingerprint:
+                skipped += 1
+                continue
+            pending[document_id] = fingerprint
+            yield document_id, document
+        if skipped:
+            logger.info("Пропущено %s неизмененных документов из %s.", skipped, total)
+
+    def commit(self, pending: dict) -> None:
+        """Функция сохраняет отпечатки документов после успешной вставки.
+
+        Args:
+            pending (dict): Отпечатки, собранные filter_changed.
+        """
+        for document_id, fingerprint in pending.items():
+            self.db[document_id] = fingerprint
+        if hasattr(self.db, "sync"):
+            self.db.sync()
+
+    def discard(self, document_ids: Iterable[str]) -> None:
+        """Функция удаляет отпечатки документов, измененных в ES в обход
+            полной вставки (например, update_by_query), чтобы следующая
+            полная версия документа не была отброшена как неизмененная.
+
+        Args:
+            document_ids (Iterable[str]): Айдишники документов.
+        """
+        for document_id in document_ids:
+            if document_id in self.db:
+                del self.db[document_id]
+        if hasattr(self.db, "sync"):
+            self.db.sync()
+
+    def clear(self) -> None:
+        """Функция удаляет все отпечатки, например перед загрузкой в новый индекс."""
+        self.db.close()
+        self.db = dbm.open(self.file_name, "n")
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def get_fingerprints(
+    file_name: str | None, prefix: str = ""
+) -> FingerprintStore | None:
+    """Функция возвращает хранилище отпечатков, если оно включено в конфиге.
+
+    Args:
+        file_name (str | None): Файл хранилища.
+        prefix (str, optional): Префикс шарда, у каждого шарда свой файл. Defaults to "".
+
+    Returns:
+        FingerprintStore | None: Хранилище отпечатков или None.
+    """
+    if not file_name:
+        return None
+    if prefix:
+        file_name = f"{file_name}.{prefix.rstrip(':')}"
+    return FingerprintStore(file_name)
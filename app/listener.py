@@ -0,0 +1,136 @@
+import json
+import select
+from collections import defaultdict
+
+import psycopg
+from backoff import backoff
+from main import EtlProcess, config, dsn, stop_on_sigterm
+from main_logger import MainLogger
+from psycopg import OperationalError
+
+logger = MainLogger().get_logger("listener")
+
+CHANNEL = "content_changes"
+LINK_TABLES = ("person_film_work", "genre_film_work")
+
+
+class ListeningEtlProcess(EtlProcess):
+    """Процесс, который обрабатывает изменения по уведомлениям Postgres
+    (LISTEN/NOTIFY) вместо постоянного опроса таблиц. Обычный проход по
+    modified выполняется при запуске, после переподключения и если
+    уведомлений не было LISTEN_CATCH_UP_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.listen_conn = None
+
+    @backoff()
+    def listen(self):
+        """Функция открывает отдельное подключение и подписывается на канал
+        уведомлений об изменениях.
+        """
+        if self.listen_conn is not None:
+            self.listen_conn.close()
+        logger.info("Подписка на канал %s.", CHANNEL)
+        self.listen_conn = psycopg.connect(**dsn, autocommit=True)
+        self.listen_conn.execute(f"LISTEN {CHANNEL}")
+
+    def start(self):
+        """Функция запускает процесс."""
+        stop_on_sigterm()
+        logger.info("Процесс запущен в режиме уведомлений.")
+        self.listen()
+        try:
+            self.catch_up()
+            while True:
+                try:
+                    changes = self.wait_changes()
+                except OperationalError:
+                    logger.exception("Потеряно подключение к каналу уведомлений.")
+                    self.listen()
+                    changes = {}
+                if changes:
+                    self.process_changes(changes)
+                else:
+                    self.catch_up()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.state.flush()
+            self.listen_conn.close()
+            self.db.close_connection()
+
+    def catch_up(self):
+        """Функция выполняет обычный проход по всем таблицам по modified,
+        чтобы обработать изменения, уведомления о которых были пропущены.
+        """
+        self.start_cycle()
+        for table_name in self.extractors:
+            self.universal_process(table_name)
+
+    def wait_changes(self) -> dict[str, set]:
+        """Функция ждет данных на подключении и собирает уведомления,
+            пришедшие в течение LISTEN_DEBOUNCE секунд. notifies(stop_after=1)
+            не подходит: уведомления, прочитанные из сокета вместе с первым,
+            psycopg отбрасывает.
+
+        Returns:
+            dict[str, set]: Айдишники изменений по таблицам или пустой словарь,
+                если уведомлений не было LISTEN_CATCH_UP_INTERVAL секунд.
+        """
+        ready, _, _ = select.select(
+            [self.listen_conn.fileno()], [], [], config.listener.catch_up_interval
+        )
+        if not ready:
+            return {}
+        changes = defaultdict(set)
+        for notify in self.listen_conn.notifies(timeout=config.listener.debounce):
+            payload = json.loads(notify.payload)
+            changes[payload["table"]].add(payload["id"])
+        return changes
+
+    def process_changes(self, changes: dict[str, set]):
+        """Функция обрабатывает пачку уведомлений. Изменения в film_work,
+            person и genre дочитываются экстракторами по курсорам, а фильмы
+            из таблиц связи загружаются напрямую по айдишникам.
+
+        Args:
+            changes (dict[str, set]): Айдишники изменений по таблицам.
+        """
+        logger.info(
+            "Получены уведомления: %s",
+            {table_name: len(ids) for table_name, ids in changes.items()},
+        )
+        self.start_cycle()
+        for table_name in self.extractors:
+            if table_name in changes:
+                self.universal_process(table_name)
+        movies_ids = set().union(*(changes.get(table) or () for table in LINK_TABLES))
+        self.load_linked_movies(movies_ids - self.queued_movies)
+
+    def load_linked_movies(self, movies_ids: set[str]):
+        """Функция загружает фильмы, у которых изменились связи с персонами
+            или жанрами.
+
+        Args:
+            movies_ids (set[str]): Айдишники фильмов.
+        """
+        # уведомления приходят всем шардам, каждый загружает только свои фильмы
+        movies_ids = {
+            movie_id
+            for movie_id in movies_ids
+            if self.extractor_filmwork.in_shard(movie_id)
+        }
+        if not movies_ids:
+            return
+        movies_list = [{"id": movie_id} for movie_id in sorted(movies_ids)]
+        self.queued_movies.update(movies_ids)
+        for movies_chunk, data in self.iter_movies_data("film_work", movies_list):
+            self.es_loader.bulk_insert_data(self.transform_movies(data))
+            logger.info(f"Успешно загружено %s документов", len(movies_chunk))
+
+
+if __name__ == "__main__":
+    etl = ListeningEtlProcess()
+    etl.start()
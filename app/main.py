@@ -1,98 +1,266 @@
+import signal
+import sys
 import time
 from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Iterator, Sequence
+from uuid import UUID, uuid4
 
 import psycopg
+from adaptive import BatchSizes
 from backoff import backoff
+from elasticsearch.exceptions import TransportError
 from elasticsearch_class import ElasticSearchLoader
 from main_logger import MainLogger
-from psycopg.rows import dict_row
-from state import JsonStorage, State
+from metrics import BATCH_ROWS, install_profiler, observe_lag, start_server, timed
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import RowFactory, dict_row, tuple_row
+from psycopg_pool import ConnectionPool
+from state import State, get_state
 
 from config import load_config
 
 logger = MainLogger().get_logger("main")
 config = load_config()
+dsn = {
+    "dbname": config.postgres.db_name,
+    "user": config.postgres.user,
+    "password": config.postgres.password,
+    "host": config.postgres.host,
+    "port": config.postgres.port,
+}
+
+JOIN_MODE = "join"
+AGGREGATE_MODE = "aggregate"
+
+Query = tuple[str, Sequence]
+
+INITIAL_CURSOR = {
+    "modified": "1111-11-11",
+    "id": "00000000-0000-0000-0000-000000000000",
+}
+
+
+def make_cursor(value: dict | str | None) -> dict | None:
+    """Функция приводит значение состояния к курсору (modified, id).
+        Состояние в старом формате (только дата) дополняется минимальным id.
+
+    Args:
+        value (dict | str | None): Значение состояния.
+
+    Returns:
+        dict | None: Курсор или None, если состояния нет.
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        return {"modified": value, "id": INITIAL_CURSOR["id"]}
+    return value
+
+
+def chunked(items: list, size: int) -> Iterator[list]:
+    """Функция разбивает список на части заданного размера.
+
+    Args:
+        items (list): Список.
+        size (int): Размер части.
+
+    Yields:
+        list: Очередная часть списка.
+    """
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def row_cursor(row: dict) -> dict:
+    """Функция формирует курсор (modified, id) по строке из базы данных.
+
+    Args:
+        row (dict): Строка с полями id и modified.
+
+    Returns:
+        dict: Курсор.
+    """
+    return {"modified": str(row["modified"]), "id": str(row["id"])}
 
 
 class Database:
+    """Пул подключений к Postgres. Подключение проверяется перед выдачей
+    из пула, запросы повторяются при ошибках подключения, а ошибки
+    самого запроса пробрасываются сразу.
+    """
 
     def __init__(self, pg_data: dict):
-        self.pg_data = pg_data
-        self.conn = self.get_connection()
+        self.pool = ConnectionPool(
+            conninfo=make_conninfo(**pg_data),
+            kwargs={"row_factory": dict_row},
+            min_size=config.postgres.pool_min_size,
+            max_size=config.postgres.pool_max_size,
+            timeout=config.postgres.pool_timeout,
+            max_idle=config.postgres.pool_max_idle,
+            check=ConnectionPool.check_connection,
+            open=False,
+        )
+        self.get_connection()
 
-    def make_query(self, statement: str, timeout: int = 1) -> list | None:
-        """Функция выполняет запрос к базе данных.
+    @backoff()
+    @timed("postgres")
+    def make_query(
+        self, statement: str, params: Sequence = None, row_factory: RowFactory = None
+    ) -> list:
+        """Функция выполняет запрос к базе данных на свободном подключении из пула.
 
         Args:
             statement (str): Запрос для выполнения.
-            timeout (int, optional): Время, в течение которого осуществляется повторный запрос . Defaults to 1.
+            params (Sequence, optional): Параметры запроса. Defaults to None.
+            row_factory (RowFactory, optional): Фабрика строк, например tuple_row. Defaults to dict_row подключения.
 
         Returns:
-            dict: Полученные данные.
+            list: Полученные данные.
         """
-        while timeout > 0:
-            try:
-                cursor = self.conn.cursor()
-                cursor.execute(statement)
-                data = cursor.fetchall()
-                return data
-            except:
-                time.sleep(timeout)
-                timeout -= 1
-                self.conn = self.get_connection()
-        return
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(row_factory=row_factory).execute(
+                statement, params, prepare=config.postgres.prepare
+            )
+            return cursor.fetchall()
 
     @backoff()
-    def get_connection(self):
-        """Функция выполняет подключение к базе данных.
+    @timed("postgres")
+    def make_queries(
+        self, queries: list[Query], row_factory: RowFactory = None
+    ) -> list[list]:
+        """Функция выполняет несколько независимых запросов в режиме pipeline:
+            запросы отправляются подряд, не дожидаясь ответов, а результаты
+            забираются после синхронизации, за один сетевой обмен.
+
+        Args:
+            queries (list[Query]): Запросы и их параметры.
+            row_factory (RowFactory, optional): Фабрика строк, например tuple_row. Defaults to dict_row подключения.
 
         Returns:
-            connection: Объект подключения к базе данных.
+            list[list]: Полученные данные в порядке запросов.
+        """
+        if len(queries) < 2 or not psycopg.Pipeline.is_supported():
+            return [self.make_query(*query, row_factory) for query in queries]
+        with self.pool.connection() as conn:
+            with conn.pipeline():
+                cursors = [
+                    conn.cursor(row_factory=row_factory).execute(
+                        statement, params, prepare=config.postgres.prepare
+                    )
+                    for statement, params in queries
+                ]
+            return [cursor.fetchall() for cursor in cursors]
+
+    def stream_query(
+        self,
+        statement: str,
+        params: Sequence = None,
+        itersize: int | None = None,
+        row_factory: RowFactory = None,
+    ) -> Iterator[list]:
+        """Функция выполняет запрос через серверный (именованный) курсор
+            и отдает результат пачками, не материализуя его целиком.
+            Подключение удерживается до конца чтения результата.
+
+        Args:
+            statement (str): Запрос для выполнения.
+            params (Sequence, optional): Параметры запроса. Defaults to None.
+            itersize (int, optional): Размер пачки. Defaults to config.extractor.itersize.
+            row_factory (RowFactory, optional): Фабрика строк, например tuple_row. Defaults to dict_row подключения.
+
+        Yields:
+            list: Очередная пачка строк.
+        """
+        itersize = int(itersize or config.extractor.itersize)
+        with self.pool.connection() as conn:
+            with conn.cursor(
+                name=f"etl_{uuid4().hex}", row_factory=row_factory
+            ) as cursor:
+                cursor.itersize = itersize
+                cursor.execute(statement, params)
+                while rows := cursor.fetchmany(itersize):
+                    yield rows
+
+    @backoff()
+    def get_connection(self):
+        """Функция открывает пул и ждет, пока будут установлены
+        min_size подключений к базе данных.
         """
         logger.info("Подключение к Postgres.")
-        conn = psycopg.connect(**self.pg_data, row_factory=dict_row)
+        self.pool.open(wait=True, timeout=config.postgres.pool_timeout)
         logger.info("подключено успешно.")
-        return conn
 
     def close_connection(self):
-        self.conn.close()
+        self.pool.close()
 
 
 class AbstractExtractor(ABC):
 
-    def __init__(self, db: Database, state: State):
+    def __init__(
+        self, db: Database, state: State, shard_index: int = 0, shard_count: int = 1
+    ):
         self.database = db
         self.state = state
+        self.shard_index = shard_index
+        self.shard_count = shard_count
 
     @abstractmethod
-    def extract_data(self):
+    def extract_data(self, current_state: dict = None):
         """Функция получает данные из определенной таблицы."""
         pass
 
 
 class BaseExtractor(AbstractExtractor):
 
-    def _get_movies_data(self, movies_ids: tuple[str]) -> dict:
-        """Функция получает финальные данные по указанным фильмам.
+    def _shard_condition(self, column: str) -> str:
+        """Функция формирует условие отбора фильмов текущего шарда. Фильмы
+            распределяются по шардам по последнему байту uuid, поэтому
+            количество шардов не может превышать 256.
 
         Args:
-            movies_ids (list): Список айдишников фильмов.
+            column (str): Колонка с айдишником фильма.
 
         Returns:
-            dict: Полученные данные.
+            str: Условие для WHERE или пустая строка, если шард один.
         """
-        movies_ids = "( " + ", ".join([f"'{mov}'" for mov in movies_ids]) + " )"
-        statement = f"""
+        if self.shard_count == 1:
+            return ""
+        return f" AND mod(get_byte(uuid_send({column}), 15), {self.shard_count}) = {self.shard_index}"
+
+    def in_shard(self, movie_id: str) -> bool:
+        """Функция проверяет, относится ли фильм к текущему шарду, по тому
+            же правилу, что и _shard_condition.
+
+        Args:
+            movie_id (str): Айдишник фильма.
+
+        Returns:
+            bool: Фильм обрабатывается этим шардом.
+        """
+        return UUID(movie_id).bytes[15] % self.shard_count == self.shard_index
+
+    def _movies_data_statement(self) -> str:
+        """Функция формирует запрос финальных данных по фильмам, айдишники
+            которых передаются одним параметром-массивом. Строки одного
+            фильма идут подряд, поэтому результат можно обрабатывать частями.
+            Выбираются только поля документа, айдишники приводятся к text:
+            такие строки дешевле разбирать и трансформировать, чем строки
+            с UUID. Внутри фильма строки упорядочены по персонам и жанрам,
+            чтобы порядок списков в документе (и его отпечаток) не зависел
+            от плана запроса.
+
+        Returns:
+            str: Запрос для выполнения.
+        """
+        return """
             SELECT
-                fw.id as fw_id, 
+                fw.id::text as fw_id, 
                 fw.title, 
                 fw.description, 
                 fw.rating, 
-                fw.type, 
-                fw.created, 
-                fw.modified, 
                 pfw.role, 
-                p.id, 
+                p.id::text, 
                 p.full_name,
                 g.name
             FROM content.film_work fw
@@ -100,9 +268,81 @@ class BaseExtractor(AbstractExtractor):
             LEFT JOIN content.person p ON p.id = pfw.person_id
             LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
             LEFT JOIN content.genre g ON g.id = gfw.genre_id
-            WHERE fw.id IN {movies_ids}; 
+            WHERE fw.id = ANY(%s::uuid[])
+            ORDER BY fw.modified, fw.id, p.full_name, p.id, g.name; 
             """
-        return self.database.make_query(statement=statement)
+
+    def _movies_aggregated_statement(
+        self, condition: str = "fw.id = ANY(%s::uuid[])"
+    ) -> str:
+        """Функция формирует запрос финальных данных по фильмам, по одной
+            строке на фильм. Персоны (сгруппированные по ролям) и жанры
+            агрегируются на стороне Postgres в отдельных lateral-подзапросах,
+            поэтому строки не размножаются при соединении. Персоны внутри
+            ролей упорядочены, чтобы документ не зависел от плана запроса.
+
+        Args:
+            condition (str, optional): Условие отбора фильмов. По умолчанию фильмы из параметра-массива айдишников.
+
+        Returns:
+            str: Запрос для выполнения.
+        """
+        return f"""
+            SELECT
+                fw.id as fw_id,
+                fw.title,
+                fw.description,
+                fw.rating,
+                fw.type,
+                fw.created,
+                fw.modified,
+                COALESCE(persons.directors, '[]') as directors,
+                COALESCE(persons.actors, '[]') as actors,
+                COALESCE(persons.writers, '[]') as writers,
+                COALESCE(genres.names, '{{}}') as genres
+            FROM content.film_work fw
+            LEFT JOIN LATERAL (
+                SELECT
+                    json_agg(
+                        json_build_object('id', p.id, 'name', p.full_name)
+                        ORDER BY p.full_name, p.id
+                    ) FILTER (WHERE pfw.role = 'director') as directors,
+                    json_agg(
+                        json_build_object('id', p.id, 'name', p.full_name)
+                        ORDER BY p.full_name, p.id
+                    ) FILTER (WHERE pfw.role = 'actor') as actors,
+                    json_agg(
+                        json_build_object('id', p.id, 'name', p.full_name)
+                        ORDER BY p.full_name, p.id
+                    ) FILTER (WHERE pfw.role = 'writer') as writers
+                FROM content.person_film_work pfw
+                JOIN content.person p ON p.id = pfw.person_id
+                WHERE pfw.film_work_id = fw.id
+            ) persons ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT array_agg(DISTINCT g.name) as names
+                FROM content.genre_film_work gfw
+                JOIN content.genre g ON g.id = gfw.genre_id
+                WHERE gfw.film_work_id = fw.id
+            ) genres ON TRUE
+            WHERE {condition}
+            ORDER BY fw.modified, fw.id;
+            """
+
+    def get_movies_statement(self, movies: list[dict]) -> Query:
+        """Функция формирует запрос финальных данных по списку фильмов
+            в зависимости от режима извлечения.
+
+        Args:
+            movies (list): Список фильмов, полученных из базы данных.
+
+        Returns:
+            Query: Запрос и его параметры.
+        """
+        movies_ids = [movie["id"] for movie in movies]
+        if config.extractor.mode == AGGREGATE_MODE:
+            return self._movies_aggregated_statement(), (movies_ids,)
+        return self._movies_data_statement(), (movies_ids,)
 
     def get_movies_data(self, movies: list[dict]) -> dict:
         """Функция принимает список фильмов, получает айдишники этих
@@ -114,38 +354,118 @@ class BaseExtractor(AbstractExtractor):
         Returns:
             dict: Финальные данные для вставки.
         """
-        movies_ids = tuple([str(movie["id"]) for movie in movies])
-        all_data = self._get_movies_data(movies_ids)
-        return all_data
+        return self.database.make_query(
+            *self.get_movies_statement(movies), row_factory=tuple_row
+        )
 
-    def _get_data_from_db(self, table_name: str) -> list:
-        """Функция получает измененные данные в зависимости от таблицы.
+    def get_movies_data_batches(self, movies_chunks: list[list[dict]]) -> list[list]:
+        """Функция получает финальные значения сразу по нескольким пачкам
+            фильмов одним pipeline-запросом.
 
         Args:
-            table_name (str): Название таблицы.
+            movies_chunks (list): Пачки фильмов, полученных из базы данных.
+
+        Returns:
+            list: Данные по каждой пачке в том же порядке.
+        """
+        return self.database.make_queries(
+            [self.get_movies_statement(movies) for movies in movies_chunks],
+            row_factory=tuple_row,
+        )
+
+    def stream_movies_data(self, movies: list[dict]) -> Iterator[list]:
+        """Функция получает финальные значения по фильмам частями через
+            серверный курсор, не загружая весь результат в память.
+
+        Args:
+            movies (list): Список фильмов, полученных из базы данных.
+
+        Yields:
+            list: Очередная пачка строк.
+        """
+        yield from self.database.stream_query(
+            *self.get_movies_statement(movies), row_factory=tuple_row
+        )
+
+    def extract_data(self, current_state: dict = None, limit: int = None) -> list:
+        """Функция получает измененные строки таблицы.
+
+        Args:
+            current_state (dict, optional): Курсор (modified, id), после которого искать изменения. По умолчанию берется из состояния.
+            limit (int, optional): Количество строк. По умолчанию LIMIT.
 
         Returns:
             list: Список с полученными значениями измененных строк.
         """
-        current_state = self.state.get_storage(table_name)
-        if not current_state:
-            statement = f'SELECT id, modified FROM "content"."{table_name}" ORDER BY modified LIMIT {config.extractor.limit}'
-        else:
-            statement = f'SELECT id, modified FROM "content"."{table_name}" WHERE modified > \'{current_state}\' ORDER BY modified LIMIT {config.extractor.limit};'
-        data = self.database.make_query(statement)
-        return data
+        return self.database.make_query(*self.extract_statement(current_state, limit))
 
+    @abstractmethod
+    def extract_statement(self, current_state: dict = None, limit: int = None) -> Query:
+        """Функция формирует запрос измененных строк таблицы."""
+        pass
 
-class ExtractFilmWork(BaseExtractor):
+    def _get_data_statement(
+        self, table_name: str, current_state: dict = None, limit: int = None
+    ) -> Query:
+        """Функция формирует запрос измененных строк таблицы с постраничной
+            выборкой по (modified, id), чтобы строки с одинаковым modified
+            не пропускались и не выбирались повторно.
 
-    def extract_data(self):
-        current_state = self.state.get_storage("film_work") or "1111-11-11"
-        statement = f"""SELECT id, modified FROM "content"."film_work"
-                        WHERE modified > '{current_state}'
-                        ORDER BY modified
-                        LIMIT {config.extractor.limit};
+        Args:
+            table_name (str): Название таблицы.
+            current_state (dict, optional): Курсор (modified, id), после которого искать изменения. По умолчанию берется из состояния.
+            limit (int, optional): Количество строк. По умолчанию LIMIT.
+
+        Returns:
+            Query: Запрос и его параметры.
+        """
+        cursor = (
+            make_cursor(current_state or self.state.get_storage(table_name))
+            or INITIAL_CURSOR
+        )
+        shard_condition = (
+            self._shard_condition("id") if table_name == "film_work" else ""
+        )
+        statement = f"""
+            SELECT id, modified FROM "content"."{table_name}"
+            WHERE (modified, id) > (%s::timestamp, %s::uuid){shard_condition}
+            ORDER BY modified, id
+            LIMIT %s;
+            """
+        return statement, (
+            cursor["modified"],
+            cursor["id"],
+            limit or config.extractor.limit,
+        )
+
+    def _fan_out_statement(self, link_table: str, link_column: str) -> str:
+        """Функция формирует запрос всех фильмов, связанных с измененными
+            строками через таблицу связи. Айдишники передаются одним
+            параметром-массивом, полусоединение через EXISTS не требует
+            DISTINCT и сортировки.
+
+        Args:
+            link_table (str): Таблица связи с film_work.
+            link_column (str): Колонка таблицы связи с айдишником измененной строки.
+
+        Returns:
+            str: Запрос для выполнения.
         """
-        return self.database.make_query(statement)
+        return f"""
+            SELECT fw.id, fw.modified
+            FROM content.film_work fw
+            WHERE EXISTS (
+                SELECT 1
+                FROM content.{link_table} lfw
+                WHERE lfw.film_work_id = fw.id AND lfw.{link_column} = ANY(%s::uuid[])
+            ){self._shard_condition("fw.id")};
+            """
+
+
+class ExtractFilmWork(BaseExtractor):
+
+    def extract_statement(self, current_state: dict = None, limit: int = None) -> Query:
+        return self._get_data_statement("film_work", current_state, limit)
 
 
 class ExtractPerson(BaseExtractor):
@@ -154,186 +474,544 @@ class ExtractPerson(BaseExtractor):
         self.offset = 0
         super().__init__(*args, **kwargs)
 
-    def extract_data(self):
-        modified_persons = self._get_data_from_db("person")
-        return modified_persons
+    def extract_statement(self, current_state: dict = None, limit: int = None) -> Query:
+        return self._get_data_statement("person", current_state, limit)
 
-    def get_movies_list(self, modified_items_ids: tuple, modified_date: str):
-        """Функция получает список фильмов по измененным строкам в таблице person.
+    def get_movies_list(self, modified_items_ids: tuple) -> list:
+        """Функция получает все фильмы, связанные с измененными строками
+            в таблице person, одним запросом.
 
         Args:
-            modified_items_ids (str): Айдишники измененных строк.
-            modified_date (str): Дата изменения последнего вставленного элемента
+            modified_items_ids (tuple): Айдишники измененных строк.
 
         Returns:
             list: Список с полученными значениями фильмов.
         """
-        statement = f"""
-                        SELECT DISTINCT fw.id, fw.modified
-                        FROM content.film_work fw
-                        LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-                        WHERE pfw.person_id IN {modified_items_ids} AND fw.modified > '{modified_date}'
-                        ORDER BY fw.modified
-                        LIMIT {config.extractor.limit};
-                        """
-        return self.database.make_query(statement)
+        return self.database.make_query(*self.movies_list_statement(modified_items_ids))
+
+    def movies_list_statement(self, modified_items_ids: tuple) -> Query:
+        """Функция формирует запрос фильмов по измененным строкам в таблице person."""
+        statement = self._fan_out_statement("person_film_work", "person_id")
+        return statement, (list(modified_items_ids),)
+
+    def get_persons(self, modified_items_ids: tuple) -> list:
+        """Функция получает имена измененных персон.
+
+        Args:
+            modified_items_ids (tuple): Айдишники измененных строк.
+
+        Returns:
+            list: Список персон с полями id и full_name.
+        """
+        statement = """
+            SELECT id, full_name FROM content.person
+            WHERE id = ANY(%s::uuid[]);
+            """
+        return self.database.make_query(statement, (list(modified_items_ids),))
 
 
 class ExtractGenre(BaseExtractor):
 
-    def get_movies_list(self, modified_items_ids: tuple, modified_date: str):
-        """Функция получает список фильмов по измененным строкам в таблице genre.
+    def get_movies_list(self, modified_items_ids: tuple) -> list:
+        """Функция получает все фильмы, связанные с измененными строками
+            в таблице genre, одним запросом.
 
         Args:
-            modified_items_ids (str): Айдишники измененных строк.
-            modified_date (str): Дата изменения последнего вставленного элемента
+            modified_items_ids (tuple): Айдишники измененных строк.
 
         Returns:
             list: Список с полученными значениями фильмов.
         """
-        statement = f"""
-                SELECT DISTINCT fw.id, fw.modified
-                FROM content.film_work fw
-                LEFT JOIN content.genre_film_work pfw ON pfw.film_work_id = fw.id 
-                WHERE pfw.genre_id IN {modified_items_ids} AND fw.modified > '{modified_date}'
-                ORDER BY fw.modified
-                LIMIT {config.extractor.limit};
-                """
-        return self.database.make_query(statement)
+        return self.database.make_query(*self.movies_list_statement(modified_items_ids))
+
+    def movies_list_statement(self, modified_items_ids: tuple) -> Query:
+        """Функция формирует запрос фильмов по измененным строкам в таблице genre."""
+        statement = self._fan_out_statement("genre_film_work", "genre_id")
+        return statement, (list(modified_items_ids),)
+
+    def extract_statement(self, current_state: dict = None, limit: int = None) -> Query:
+        return self._get_data_statement("genre", current_state, limit)
+
+
+ROLE_FIELDS = {"director": "directors", "actor": "actors", "writer": "writers"}
 
-    def extract_data(self):
-        return self._get_data_from_db("genre")
+
+class MovieRecord:
+    """Промежуточная запись фильма при трансформации. Жанры и персоны
+    хранятся в словарях (ключи - имена), поэтому проверка на дубликат
+    не зависит от количества уже добавленных значений.
+    """
+
+    __slots__ = ("id", "title", "description", "imdb_rating", "genres", "persons")
+
+    def __init__(self, movie_id: str, title: str, description: str, rating: float):
+        self.id = movie_id
+        self.title = str(title)
+        self.description = str(description)
+        self.imdb_rating = rating or 0
+        self.genres = {}
+        self.persons = {role: {} for role in ROLE_FIELDS}
+
+    def as_document(self) -> dict:
+        """Функция формирует документ для вставки в ES.
+
+        Returns:
+            dict: Документ фильма.
+        """
+        document = {
+            "id": self.id,
+            "title": self.title,
+            "description": self.description,
+            "imdb_rating": self.imdb_rating,
+        }
+        for role, field in ROLE_FIELDS.items():
+            persons = self.persons[role]
+            document[field] = [
+                {"id": person_id, "name": name} for name, person_id in persons.items()
+            ]
+            document[f"{field}_names"] = list(persons)
+        document["genres"] = list(self.genres)
+        return document
 
 
 class Transform:
+    """Трансформация строк из базы в документы ES. Строки приходят
+    кортежами (tuple_row) в порядке колонок запросов _movies_data_statement
+    и _movies_aggregated_statement.
+    """
 
+    @timed("transform")
     def prepare_data(self, data: list) -> dict:
         """Функция переводит финальные данные по фильмам в вид для вставки в ES
 
         Args:
             data (list): Данные фильмов.
 
+        Returns:
+            dict: Словарь с измененными данными.
+        """
+        movies = {}
+        for (
+            fw_id,
+            title,
+            description,
+            rating,
+            role,
+            person_id,
+            full_name,
+            genre,
+        ) in data:
+            movie = movies.get(fw_id)
+            if movie is None:
+                movie = movies[fw_id] = MovieRecord(fw_id, title, description, rating)
+            if genre is not None:
+                movie.genres[genre] = None
+            persons = movie.persons.get(role)
+            if persons is not None and full_name not in persons:
+                persons[full_name] = person_id
+        return {movie.id: movie.as_document() for movie in movies.values()}
+
+    def iter_prepared_data(
+        self, chunks: Iterator[list], aggregated: bool = False
+    ) -> Iterator[tuple[str, dict]]:
+        """Функция трансформирует данные по мере их получения из базы.
+            Строки одного фильма должны идти подряд, фильм отдается,
+            как только встречена строка следующего фильма.
+
+        Args:
+            chunks (Iterator[list]): Пачки строк из базы данных.
+            aggregated (bool, optional): Данные получены в режиме aggregate. Defaults to False.
+
+        Yields:
+            tuple[str, dict]: Айдишник фильма и документ для вставки в ES.
+        """
+        movie_rows = []
+        for chunk in chunks:
+            if aggregated:
+                yield from self.prepare_aggregated_data(chunk).items()
+                continue
+            for row in chunk:
+                if movie_rows and movie_rows[-1][0] != row[0]:
+                    yield from self.prepare_data(movie_rows).items()
+                    movie_rows = []
+                movie_rows.append(row)
+        if movie_rows:
+            yield from self.prepare_data(movie_rows).items()
+
+    @timed("transform")
+    def prepare_aggregated_data(self, data: list) -> dict:
+        """Функция переводит агрегированные данные по фильмам (по одной строке
+            на фильм) в вид для вставки в ES.
+
+        Args:
+            data (list): Данные фильмов, полученные в режиме aggregate.
+
         Returns:
             dict: Словарь с измененными данными.
         """
         result = {}
-        for row in data:
-            current_movie = result.setdefault(str(row["fw_id"]), {})
-            if not current_movie:
-                current_movie["id"] = str(row["fw_id"])
-                current_movie["title"] = str(row["title"])
-                current_movie["description"] = str(row["description"])
-                current_movie["imdb_rating"] = row["rating"] or 0
-                current_movie["title"] = str(row["title"])
-                current_movie["description"] = str(row["description"])
-                for role in ("directors", "actors", "writers"):
-                    current_movie[role] = []
-                    current_movie[f"{role}_names"] = []
-            genres = current_movie.setdefault("genres", [])
-            if row["name"] not in genres:
-                genres.append(str(row["name"]))
-            role = row["role"]
-            if role == "director":
-                directors_name = current_movie.setdefault("directors_names", [])
-                if str(row["full_name"]) not in directors_name:
-                    directors_name.append(str(row["full_name"]))
-                    current_movie.setdefault("directors", []).append(
-                        dict(id=str(row["id"]), name=str(row["full_name"]))
-                    )
-            elif role == "actor":
-                actors_name = current_movie.setdefault("actors_names", [])
-                if str(row["full_name"]) not in actors_name:
-                    actors_name.append(str(row["full_name"]))
-                    current_movie.setdefault("actors", []).append(
-                        dict(id=str(row["id"]), name=str(row["full_name"]))
-                    )
-            elif role == "writer":
-                writers_name = current_movie.setdefault("writers_names", [])
-                if str(row["full_name"]) not in writers_name:
-                    writers_name.append(str(row["full_name"]))
-                    current_movie.setdefault("writers", []).append(
-                        dict(id=str(row["id"]), name=str(row["full_name"]))
-                    )
+        for (
+            fw_id,
+            title,
+            description,
+            rating,
+            _,
+            _,
+            _,
+            directors,
+            actors,
+            writers,
+            genres,
+        ) in data:
+            movie = MovieRecord(str(fw_id), title, description, rating)
+            for role, persons in zip(ROLE_FIELDS, (directors, actors, writers)):
+                names = movie.persons[role]
+                for person in persons:
+                    names.setdefault(person["name"], person["id"])
+            movie.genres = dict.fromkeys(genres)
+            result[movie.id] = movie.as_document()
         return result
 
 
+def shard_prefix(shard_index: int, shard_count: int) -> str:
+    """Функция возвращает префикс ключей состояния для шарда.
+
+    Args:
+        shard_index (int): Номер шарда.
+        shard_count (int): Количество шардов.
+
+    Returns:
+        str: Префикс ключей или пустая строка, если шард один.
+    """
+    if shard_count == 1:
+        return ""
+    return f"shard_{shard_index}_of_{shard_count}:"
+
+
+def stop_on_sigterm() -> None:
+    """Функция переводит SIGTERM (docker stop) в SystemExit, чтобы при
+    остановке выполнились блоки finally и состояние было сохранено.
+    """
+
+    def handler(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
 class EtlProcess:
-    def __init__(self):
-        self.state = State(storage=JsonStorage())
+    def __init__(self, shard_index: int = None, shard_count: int = None):
+        self.shard_index = config.shard.index if shard_index is None else shard_index
+        self.shard_count = shard_count or config.shard.count
+        prefix = shard_prefix(self.shard_index, self.shard_count)
+        self.state = get_state(prefix=prefix)
+        start_server(config.metrics.port, self.shard_index)
+        install_profiler(config.metrics.profile_dir)
         self.db = Database(pg_data=dsn)
-        self.extractor_person = ExtractPerson(db=self.db, state=self.state)
+        shard = {"shard_index": self.shard_index, "shard_count": self.shard_count}
+        self.extractor_person = ExtractPerson(db=self.db, state=self.state, **shard)
         self.transformer = Transform()
-        self.es_loader = ElasticSearchLoader()
+        self.es_loader = ElasticSearchLoader(prefix=prefix)
         self.es_loader.create_index()
-        self.extractor_genre = ExtractGenre(db=self.db, state=self.state)
-        self.extractor_filmwork = ExtractFilmWork(db=self.db, state=self.state)
+        self.extractor_genre = ExtractGenre(db=self.db, state=self.state, **shard)
+        self.extractor_filmwork = ExtractFilmWork(db=self.db, state=self.state, **shard)
         self.extractors = {
             "film_work": self.extractor_filmwork,
             "person": self.extractor_person,
             "genre": self.extractor_genre,
         }
+        self.batch_sizes = {table_name: BatchSizes() for table_name in self.extractors}
 
     def start(self):
-        """Функция запускает процесс."""
+        """Функция запускает процесс. Состояние сохраняется при любом
+        выходе из цикла: по Ctrl+C, SIGTERM или ошибке.
+        """
+        stop_on_sigterm()
         logger.info("Процесс запущен.")
+        try:
+            while True:
+                self.start_cycle()
+                counter = 0
+                for extractor in self.extractors:
+                    counter += self.universal_process(extractor)
+                logger.info("Итерация завершена!")
+                if not counter:
+                    # опрос таблиц приостанавливается, только если изменений нет
+                    time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.state.flush()
+            self.db.close_connection()
+
+    def rebuild(self):
+        """Функция выполняет полную переиндексацию всех фильмов в новую
+        версию индекса и переключает на нее алиас. Состояние person и genre
+        сдвигается на момент начала переиндексации, так как их изменения
+        до этого момента уже попадут в новые документы.
+        """
+        if self.shard_count > 1:
+            raise RuntimeError(
+                "Полная переиндексация не поддерживается в режиме шардов."
+            )
+        logger.info("Запущена полная переиндексация.")
+        started = str(self.db.make_query("SELECT localtimestamp AS now")[0]["now"])
+        self.es_loader.start_rebuild()
+        current_state = INITIAL_CURSOR
+        counter = 0
+        while rows := self.extractor_filmwork.extract_data(current_state):
+            self.load_movies("film_work", rows)
+            current_state = row_cursor(rows[-1])
+            counter += len(rows)
+            logger.info("Переиндексировано %s фильмов.", counter)
+        self.es_loader.finish_rebuild()
+        self.state.save_storage("film_work", current_state)
+        self.state.save_storage("person", make_cursor(started))
+        self.state.save_storage("genre", make_cursor(started))
+        self.state.flush()
+        logger.info("Полная переиндексация завершена.")
+
+    def start_cycle(self):
+        """Функция начинает новую итерацию обхода таблиц: запоминает время
+        начала по часам базы и очищает множество загруженных фильмов.
+        """
+        self.cycle_started = self.db.make_query("SELECT localtimestamp AS now")[0][
+            "now"
+        ]
+        self.clock_offset = self.cycle_started - datetime.now()
+        self.queued_movies = set()
+
+    def database_now(self) -> datetime:
+        """Функция возвращает текущее время по часам базы без запроса к ней:
+            к локальному времени добавляется разница часов, измеренная
+            в начале итерации.
+
+        Returns:
+            datetime: Текущее время базы.
+        """
+        return datetime.now() + self.clock_offset
+
+    def save_cursor(self, table_name: str, previous: dict | None, cursor: dict) -> bool:
+        """Функция сдвигает курсор таблицы, только если его не изменил другой
+            процесс с общим состоянием. Иначе курсор не трогается, и
+            следующая пачка читается от курсора другого процесса: курсор
+            не сдвигается назад, а повторная загрузка фильмов безопасна.
+
+        Args:
+            table_name (str): Название таблицы.
+            previous (dict | None): Курсор, от которого получена пачка.
+            cursor (dict): Курсор последней обработанной строки.
+
+        Returns:
+            bool: Курсор сохранен.
+        """
+        if self.state.compare_and_set(table_name, previous, cursor):
+            return True
+        logger.warning(
+            "Курсор таблицы %s изменен другим процессом, продолжаю с него.",
+            table_name,
+        )
+        return False
+
+    def fan_out_movies(self, rows: list, movies_list: list) -> list:
+        """Функция отбрасывает фильмы, уже загруженные в текущей итерации.
+            Фильм пропускается, только если все изменения пачки произошли до
+            начала итерации: тогда загруженный документ их уже содержит.
+
+        Args:
+            rows (list): Пачка измененных строк person/genre.
+            movies_list (list): Связанные с ними фильмы.
+
+        Returns:
+            list: Фильмы, которые нужно загрузить.
+        """
+        if rows[-1]["modified"] < self.cycle_started:
+            movies_list = [
+                movie
+                for movie in movies_list
+                if str(movie["id"]) not in self.queued_movies
+            ]
+        self.queued_movies.update(str(movie["id"]) for movie in movies_list)
+        return movies_list
+
+    def iter_movies_data(
+        self, table_name: str, movies_list: list
+    ) -> Iterator[tuple[list, list]]:
+        """Функция делит фильмы на пачки по текущему LIMIT таблицы и получает
+            данные сразу по EXTRACT_PIPELINE_DEPTH пачкам за один pipeline-запрос.
+
+        Args:
+            table_name (str): Название таблицы.
+            movies_list (list): Список фильмов для загрузки.
+
+        Yields:
+            tuple[list, list]: Пачка фильмов и финальные данные по ней.
+        """
+        extractor = self.extractors[table_name]
+        movies_chunks = list(
+            chunked(movies_list, self.batch_sizes[table_name].limit.value)
+        )
+        for group in chunked(movies_chunks, config.extractor.pipeline_depth):
+            yield from zip(group, extractor.get_movies_data_batches(group))
+
+    def update_persons(self, rows: list) -> list:
+        """Функция обновляет имена измененных персон во всех фильмах одним
+            запросом update_by_query, не перезаписывая документы целиком.
+            Если часть документов была одновременно изменена другой
+            вставкой, возвращаются фильмы для полной переиндексации.
+
+        Args:
+            rows (list): Пачка измененных строк person.
+
+        Returns:
+            list: Фильмы, которые нужно загрузить полностью.
+        """
+        rows_id = tuple(row["id"] for row in rows)
+        persons = self.extractor_person.get_persons(rows_id)
+        response = self.es_loader.update_persons(
+            {str(person["id"]): str(person["full_name"]) for person in persons}
+        )
+        if response["version_conflicts"]:
+            logger.info(
+                "Конфликт версий при обновлении %s фильмов, загружаю полностью.",
+                response["version_conflicts"],
+            )
+            return self.fan_out_movies(
+                rows, self.extractor_person.get_movies_list(rows_id)
+            )
+        logger.info("Имена персон обновлены в %s фильмах.", response["updated"])
+        if self.es_loader.fingerprints and response["updated"]:
+            # документы изменены скриптом, их отпечатки больше не совпадают с ES
+            self.es_loader.fingerprints.discard(
+                str(movie["id"])
+                for movie in self.extractor_person.get_movies_list(rows_id)
+            )
+        return []
+
+    def load_movies(
+        self, table_name: str, movies_list: list, data: list | None = None
+    ) -> dict:
+        """Функция получает финальные данные по фильмам, трансформирует их
+            и загружает в ES.
+
+        Args:
+            table_name (str): Название таблицы.
+            movies_list (list): Список фильмов для загрузки.
+            data (list, optional): Уже полученные финальные данные по фильмам. Defaults to None.
+
+        Returns:
+            dict: Курсор (modified, id) последнего загруженного фильма.
+        """
+        extractor = self.extractors[table_name]
+        chunk_size = self.batch_sizes[table_name].chunk_size
+        self.es_loader.take_stats()
         while True:
-            for extractor in self.extractors:
-                try:
-                    self.universal_process(extractor)
-                except KeyboardInterrupt:
-                    self.db.close_connection()
-                    exit()
-            logger.info("Итерация завершена!")
-
-    def universal_process(self, table_name: str):
+            self.es_loader.chunk_size = chunk_size.value
+            try:
+                if config.extractor.stream:
+                    chunks = extractor.stream_movies_data(movies_list)
+                    self.es_loader.bulk_insert_stream(
+                        self.transformer.iter_prepared_data(
+                            chunks, config.extractor.mode == AGGREGATE_MODE
+                        )
+                    )
+                else:
+                    if data is None:
+                        data = extractor.get_movies_data(movies_list)
+                    self.es_loader.bulk_insert_data(self.transform_movies(data))
+                break
+            except TransportError as error:
+                # 413: запрос больше http.max_content_length, пачка делится
+                # пополам и загружается заново, пока не дойдет до минимума
+                if error.status_code != 413 or chunk_size.value <= chunk_size.minimum:
+                    raise
+                self.es_loader.take_stats()
+                chunk_size.update(0, rejected=True)
+                logger.warning(
+                    "ES отклонил запрос bulk как слишком большой, размер части %s.",
+                    chunk_size.value,
+                )
+        # учитывается только время запросов к ES, без чтения и трансформации
+        stats = self.es_loader.take_stats()
+        if stats.requests:
+            chunk_size.update(
+                stats.seconds / stats.requests,
+                rejected=stats.rejections > 0,
+                document_bytes=stats.bytes / max(1, stats.documents),
+            )
+        return row_cursor(movies_list[-1])
+
+    def transform_movies(self, data: list) -> dict:
+        """Функция трансформирует финальные данные по фильмам в зависимости
+            от режима извлечения.
+
+        Args:
+            data (list): Данные фильмов.
+
+        Returns:
+            dict: Словарь с данными для вставки в ES.
+        """
+        if config.extractor.mode == AGGREGATE_MODE:
+            return self.transformer.prepare_aggregated_data(data)
+        return self.transformer.prepare_data(data)
+
+    def universal_process(self, table_name: str) -> int:
         """Функция принимает название таблицы и производит получение/трансформацию/вставку
             данных.
 
         Args:
             table_name (str): Название таблицы.
+
+        Returns:
+            int: Количество обработанных строк таблицы.
         """
         logger.info(f"Началась обработка таблицы: %s", table_name)
         counter = 0
+        limit = self.batch_sizes[table_name].limit
         while True:
-            time.sleep(0.5)
-            is_go = True
-            self.state.save_storage("tmp_date", "1111-11-11")
-            rows = self.extractors[table_name].extract_data()
+            started = time.perf_counter()
+            previous = self.state.get_storage(table_name)
+            rows = self.extractors[table_name].extract_data(previous, limit=limit.value)
             if not rows:
-                break
+                observe_lag(table_name, None, self.database_now())
+                return counter
+            BATCH_ROWS.labels(table_name).observe(len(rows))
             logger.info(f"Из таблицы %s получено %s записей", table_name, len(rows))
-            rows_id = tuple(row["id"] for row in rows)
-            while is_go:
-                tmp_date = self.state.get_storage("tmp_date")
-                if table_name != "film_work":
-                    movies_list = self.extractors[table_name].get_movies_list(
-                        rows_id, tmp_date
-                    )
-                else:
-                    movies_list = rows
-                    is_go = False
-                if not movies_list:
-                    break
-                data = self.extractors[table_name].get_movies_data(movies_list)
-                prepared_data = self.transformer.prepare_data(data)
-                self.es_loader.bulk_insert_data(prepared_data)
-                logger.info(f"Успешно загружено %s документов", len(movies_list))
-                self.state.save_storage("tmp_date", str(data[-1]["modified"]))
-            self.state.save_storage(table_name, str(rows[-1]["modified"]))
+            if table_name == "film_work":
+                movies_list = rows
+                self.queued_movies.update(str(row["id"]) for row in rows)
+            elif table_name == "person" and config.extractor.partial_updates:
+                movies_list = self.update_persons(rows)
+            else:
+                rows_id = tuple(row["id"] for row in rows)
+                movies_list = self.fan_out_movies(
+                    rows, self.extractors[table_name].get_movies_list(rows_id)
+                )
+            if config.extractor.stream:
+                batches = (
+                    (movies_chunk, None)
+                    for movies_chunk in chunked(movies_list, limit.value)
+                )
+            else:
+                batches = self.iter_movies_data(table_name, movies_list)
+            for movies_chunk, data in batches:
+                self.load_movies(table_name, movies_chunk, data)
+                logger.info(f"Успешно загружено %s документов", len(movies_chunk))
+            self.save_cursor(table_name, previous, row_cursor(rows[-1]))
+            self.state.checkpoint()
+            observe_lag(table_name, rows[-1]["modified"], self.database_now())
+            limit.update(time.perf_counter() - started)
             counter += len(rows)
             logger.info(
-                f"Всего успешно обработано %s записей из таблицы %s.", counter, table_name
+                f"Всего успешно обработано %s записей из таблицы %s.",
+                counter,
+                table_name,
             )
 
 
 if __name__ == "__main__":
-    dsn = {
-        "dbname": config.postgres.db_name,
-        "user": config.postgres.user,
-        "password": config.postgres.password,
-        "host": config.postgres.host,
-        "port": config.postgres.port,
-    }
     print(dsn)
     etl = EtlProcess()
+    if "rebuild" in sys.argv[1:]:
+        etl.rebuild()
     etl.start()
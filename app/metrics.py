@@ -0,0 +1,145 @@
+import cProfile
+import os
+import signal
+import time
+from datetime import datetime
+from functools import wraps
+
+from main_logger import MainLogger
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = MainLogger().get_logger("metrics")
+
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+STAGE_SECONDS = Histogram(
+    "etl_stage_seconds", "Длительность стадии ETL, секунды.", ["stage"]
+)
+BATCH_ROWS = Histogram(
+    "etl_batch_rows",
+    "Количество измененных строк в пачке.",
+    ["table"],
+    buckets=BATCH_BUCKETS,
+)
+BULK_DOCUMENTS = Histogram(
+    "etl_bulk_documents",
+    "Количество документов в вызове загрузки.",
+    buckets=BATCH_BUCKETS,
+)
+BULK_BYTES = Histogram(
+    "etl_bulk_request_bytes",
+    "Размер тела запроса bulk до сжатия, байты.",
+    buckets=BYTES_BUCKETS,
+)
+BULK_ERRORS = Counter("etl_bulk_errors_total", "Документы, не вставленные в ES.")
+BACKOFF_RETRIES = Counter(
+    "etl_backoff_retries_total", "Повторы после ошибок подключения.", ["function"]
+)
+LAG_SECONDS = Gauge(
+    "etl_lag_seconds",
+    "Отставание: время базы минус modified последнего сохраненного курсора.",
+    ["table"],
+)
+
+
+def timed(stage: str):
+    """Декоратор, записывающий длительность вызова в etl_stage_seconds.
+
+    Args:
+        stage (str): Название стадии.
+    """
+    histogram = STAGE_SECONDS.labels(stage)
+
+    def func_wrapper(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return inner
+
+    return func_wrapper
+
+
+def async_timed(stage: str):
+    """Декоратор корутин, записывающий длительность вызова в etl_stage_seconds.
+
+    Args:
+        stage (str): Название стадии.
+    """
+    histogram = STAGE_SECONDS.labels(stage)
+
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return inner
+
+    return func_wrapper
+
+
+def observe_lag(table_name: str, modified: datetime | None, now: datetime) -> None:
+    """Функция обновляет отставание таблицы.
+
+    Args:
+        table_name (str): Название таблицы.
+        modified (datetime | None): modified последней обработанной строки или None, если изменений нет.
+        now (datetime): Текущее время по часам базы на момент сохранения курсора.
+    """
+    lag = (now - modified).total_seconds() if modified else 0
+    LAG_SECONDS.labels(table_name).set(max(lag, 0))
+
+
+def start_server(port: int, shard_index: int = 0) -> None:
+    """Функция запускает HTTP-эндпоинт /metrics в формате Prometheus.
+        Каждый шард слушает свой порт: port + shard_index.
+
+    Args:
+        port (int): Базовый порт, 0 - эндпоинт отключен.
+        shard_index (int, optional): Номер шарда. Defaults to 0.
+    """
+    if not port:
+        return
+    start_http_server(port + shard_index)
+    logger.info("Метрики доступны на порту %s.", port + shard_index)
+
+
+def install_profiler(profile_dir: str | None) -> None:
+    """Функция включает профилирование по сигналу: первый SIGUSR1 запускает
+        cProfile в основном потоке, следующий останавливает его и сохраняет
+        статистику в profile_dir. Для сэмплирования без остановки процесса
+        можно подключаться py-spy к pid процесса.
+
+    Args:
+        profile_dir (str | None): Каталог для файлов .prof, None - профилирование отключено.
+    """
+    if not profile_dir:
+        return
+    profiler = None
+
+    def toggle(signum, frame):
+        nonlocal profiler
+        if profiler is None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            logger.info("Профилирование запущено.")
+            return
+        profiler.disable()
+        file_name = os.path.join(
+            profile_dir, f"etl-{os.getpid()}-{time.strftime('%Y%m%d%H%M%S')}.prof"
+        )
+        profiler.dump_stats(file_name)
+        profiler = None
+        logger.info("Профиль сохранен в %s.", file_name)
+
+    os.makedirs(profile_dir, exist_ok=True)
+    signal.signal(signal.SIGUSR1, toggle)
@@ -0,0 +1,208 @@
+import threading
+import time
+from dataclasses import dataclass
+from queue import Empty, Full, Queue
+
+from datetime import datetime
+
+from main import EtlProcess, config, row_cursor, stop_on_sigterm
+from main_logger import MainLogger
+from metrics import BATCH_ROWS, observe_lag
+
+logger = MainLogger().get_logger("pipeline")
+
+STOP = None
+
+
+@dataclass
+class Batch:
+    table_name: str
+    data: list | None = None
+    documents: dict | None = None
+    checkpoint: tuple[str, dict | None, dict] | None = None
+    modified: datetime | None = None
+
+
+class PipelinedEtlProcess(EtlProcess):
+    """Процесс, в котором получение, трансформация и вставка данных
+    выполняются одновременно в отдельных потоках, связанных очередями
+    ограниченного размера.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.transform_queue = Queue(maxsize=config.pipeline.queue_size)
+        self.load_queue = Queue(maxsize=config.pipeline.queue_size)
+        self.stop_event = threading.Event()
+        self.cursors_changed = threading.Event()
+        self.errors = []
+
+    def start(self):
+        """Функция запускает потоки и ждет их завершения."""
+        stop_on_sigterm()
+        logger.info("Процесс запущен в режиме конвейера.")
+        workers = [
+            threading.Thread(target=self._run, args=(stage,), name=stage.__name__)
+            for stage in (self.extract_stage, self.transform_stage, self.load_stage)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # при SIGTERM потоки стадий тоже нужно остановить до сохранения
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+            self.state.flush()
+            self.db.close_connection()
+        if self.errors:
+            raise self.errors[0]
+
+    def _run(self, stage):
+        """Функция выполняет стадию и останавливает остальные при ошибке.
+
+        Args:
+            stage (Callable): Стадия конвейера.
+        """
+        try:
+            stage()
+        except Exception as error:
+            logger.exception("Ошибка в стадии %s", stage.__name__)
+            self.errors.append(error)
+            self.stop_event.set()
+
+    def _put(self, queue: Queue, item: Batch | None) -> bool:
+        """Функция кладет элемент в очередь, не блокируясь навсегда при остановке.
+
+        Returns:
+            bool: Элемент помещен в очередь.
+        """
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get(self, queue: Queue) -> Batch | None:
+        """Функция забирает элемент из очереди, не блокируясь навсегда при остановке.
+
+        Returns:
+            Batch | None: Очередной элемент или STOP.
+        """
+        while not self.stop_event.is_set():
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                continue
+        return STOP
+
+    def extract_stage(self):
+        """Стадия получения данных. Курсоры по таблицам хранятся локально,
+        чтобы получение шло дальше, не дожидаясь сохранения состояния.
+        Если курсор изменил другой процесс, локальные курсоры перечитываются
+        из состояния.
+        """
+        cursors = {}
+        try:
+            while not self.stop_event.is_set():
+                if not cursors or self.cursors_changed.is_set():
+                    self.cursors_changed.clear()
+                    cursors = {
+                        table_name: self.state.get_storage(table_name)
+                        for table_name in self.extractors
+                    }
+                self.start_cycle()
+                is_idle = True
+                for table_name in self.extractors:
+                    new_state = self._extract_table(table_name, cursors[table_name])
+                    if new_state:
+                        cursors[table_name] = new_state
+                        is_idle = False
+                    else:
+                        observe_lag(table_name, None, self.database_now())
+                if is_idle:
+                    time.sleep(0.5)
+        finally:
+            self._put(self.transform_queue, STOP)
+
+    def _extract_table(
+        self, table_name: str, current_state: dict | None
+    ) -> dict | None:
+        """Функция получает одну пачку измененных строк таблицы и отправляет
+            данные по затронутым фильмам на трансформацию.
+
+        Args:
+            table_name (str): Название таблицы.
+            current_state (dict | None): Курсор (modified, id), после которого искать изменения.
+
+        Returns:
+            dict | None: Новое значение курсора или None, если изменений нет.
+        """
+        extractor = self.extractors[table_name]
+        rows = extractor.extract_data(current_state)
+        if not rows:
+            return None
+        BATCH_ROWS.labels(table_name).observe(len(rows))
+        logger.info(f"Из таблицы %s получено %s записей", table_name, len(rows))
+        last_modified = row_cursor(rows[-1])
+        checkpoint = (table_name, current_state, last_modified)
+        modified = rows[-1]["modified"]
+        if table_name == "film_work":
+            self.queued_movies.update(str(row["id"]) for row in rows)
+            data = extractor.get_movies_data(rows)
+            self._put(
+                self.transform_queue,
+                Batch(
+                    table_name,
+                    data=data,
+                    checkpoint=checkpoint,
+                    modified=modified,
+                ),
+            )
+            return last_modified
+        rows_id = tuple(row["id"] for row in rows)
+        movies_list = self.fan_out_movies(rows, extractor.get_movies_list(rows_id))
+        for _, data in self.iter_movies_data(table_name, movies_list):
+            self._put(self.transform_queue, Batch(table_name, data=data))
+        self._put(
+            self.transform_queue,
+            Batch(table_name, checkpoint=checkpoint, modified=modified),
+        )
+        return last_modified
+
+    def transform_stage(self):
+        """Стадия трансформации данных."""
+        try:
+            while (batch := self._get(self.transform_queue)) is not STOP:
+                if batch.data:
+                    batch.documents = self.transform_movies(batch.data)
+                    batch.data = None
+                self._put(self.load_queue, batch)
+        finally:
+            self._put(self.load_queue, STOP)
+
+    def load_stage(self):
+        """Стадия вставки данных. Состояние сохраняется только после
+        успешной вставки всех предшествующих пачек.
+        """
+        while (batch := self._get(self.load_queue)) is not STOP:
+            if batch.documents:
+                self.es_loader.bulk_insert_data(batch.documents)
+                logger.info(f"Успешно загружено %s документов", len(batch.documents))
+            if batch.checkpoint:
+                if not self.save_cursor(*batch.checkpoint):
+                    self.cursors_changed.set()
+                self.state.checkpoint()
+                observe_lag(batch.table_name, batch.modified, self.database_now())
+
+
+if __name__ == "__main__":
+    etl = PipelinedEtlProcess()
+    etl.start()
@@ -0,0 +1,57 @@
+from multiprocessing import Process
+
+from main import EtlProcess, config, stop_on_sigterm
+from main_logger import MainLogger
+
+logger = MainLogger().get_logger("sharded")
+
+# время, которое дается шардам на сохранение состояния после SIGINT
+STOP_TIMEOUT = 10
+
+
+def run_shard(shard_index: int, shard_count: int) -> None:
+    """Функция запускает процесс ETL для одного шарда. Подключения к Postgres
+        и ES создаются внутри дочернего процесса.
+
+    Args:
+        shard_index (int): Номер шарда.
+        shard_count (int): Количество шардов.
+    """
+    etl = EtlProcess(shard_index=shard_index, shard_count=shard_count)
+    etl.start()
+
+
+def start(shard_count: int) -> None:
+    """Функция запускает по процессу на каждый шард и ждет их завершения.
+        Процессы шардов не daemon, чтобы они сами могли запускать дочерние
+        процессы, поэтому при выходе они останавливаются явно.
+
+    Args:
+        shard_count (int): Количество шардов.
+    """
+    stop_on_sigterm()
+    logger.info("Запуск %s шардов.", shard_count)
+    workers = [
+        Process(target=run_shard, args=(shard_index, shard_count))
+        for shard_index in range(shard_count)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # SIGINT получает вся группа процессов, шарды завершаются сами
+        for worker in workers:
+            worker.join(timeout=STOP_TIMEOUT)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                logger.warning("Остановка шарда %s.", worker.name)
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    start(config.shard.count)
@@ -0,0 +1,170 @@
+import gzip
+import os
+import sys
+from itertools import islice
+from typing import Iterator
+
+import orjson
+from elasticsearch_class import ElasticSearchLoader
+from main import Database, ExtractFilmWork, Transform, config, dsn, make_cursor
+from main_logger import MainLogger
+from state import get_state
+
+logger = MainLogger().get_logger("snapshot")
+
+# типы колонок COPY в порядке колонок _movies_aggregated_statement
+COPY_TYPES = (
+    "uuid",
+    "text",
+    "text",
+    "float8",
+    "text",
+    "text",
+    "text",
+    "json",
+    "json",
+    "json",
+    "text[]",
+)
+
+# таблицы, курсоры которых сдвигаются на время снимка (EtlProcess.extractors)
+TABLES = ("film_work", "person", "genre")
+
+
+class SnapshotEtlProcess:
+    """Процесс полной выгрузки фильмов в файл снимка и загрузки из него.
+    Снимок снимается одним запросом COPY в согласованном срезе базы и
+    хранится в NDJSON, сжатом gzip: первая строка - время снимка, далее
+    по документу ES на строку. Загрузка снимка идет в новую версию
+    индекса и не обращается к Postgres, поэтому снимок можно повторно
+    загрузить после изменения schema.json. Подключение к Postgres
+    открывается только на время выгрузки, так что загрузка снимка
+    работает и при недоступной базе.
+    """
+
+    def __init__(self):
+        self.state = get_state()
+        self.es_loader = ElasticSearchLoader()
+
+    def export(self, file_name: str = None) -> int:
+        """Функция выгружает все фильмы в файл снимка. Файл записывается
+            во временный и переименовывается после успешной выгрузки.
+
+        Args:
+            file_name (str, optional): Файл снимка. По умолчанию SNAPSHOT_FILE.
+
+        Returns:
+            int: Количество выгруженных фильмов.
+        """
+        self._check_shards()
+        file_name = file_name or config.snapshot.file_name
+        db = Database(pg_data=dsn)
+        extractor = ExtractFilmWork(db=db, state=self.state)
+        statement = extractor._movies_aggregated_statement("TRUE")
+        columns = ", ".join(
+            f"{column}::{column_type}"
+            for column, column_type in zip(
+                (
+                    "fw_id",
+                    "title",
+                    "description",
+                    "rating",
+                    "type",
+                    "created",
+                    "modified",
+                    "directors",
+                    "actors",
+                    "writers",
+                    "genres",
+                ),
+                COPY_TYPES,
+            )
+        )
+        copy_statement = (
+            f"COPY (SELECT {columns} FROM ({statement.strip().rstrip(';')}) films)"
+            " TO STDOUT"
+        )
+        transformer = Transform()
+        counter = 0
+        logger.info("Выгрузка снимка в %s.", file_name)
+        try:
+            with db.pool.connection() as conn:
+                # время снимка и COPY должны видеть один и тот же срез базы
+                conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                row = conn.execute("SELECT localtimestamp AS now").fetchone()
+                snapshot_time = row["now"]
+                with gzip.open(
+                    f"{file_name}.tmp",
+                    "wb",
+                    compresslevel=config.snapshot.compress_level,
+                ) as file:
+                    file.write(orjson.dumps({"snapshot": str(snapshot_time)}) + b"\n")
+                    with conn.cursor().copy(copy_statement) as copy:
+                        copy.set_types(COPY_TYPES)
+                        rows = copy.rows()
+                        while chunk := list(islice(rows, config.extractor.limit)):
+                            documents = transformer.prepare_aggregated_data(chunk)
+                            file.writelines(
+                                orjson.dumps(document) + b"\n"
+                                for document in documents.values()
+                            )
+                            counter += len(documents)
+        finally:
+            db.close_connection()
+        os.replace(f"{file_name}.tmp", file_name)
+        logger.info("В снимок выгружено %s фильмов на %s.", counter, snapshot_time)
+        return counter
+
+    def replay(self, file_name: str = None) -> int:
+        """Функция загружает снимок в новую версию индекса и переключает на
+            нее алиас. Состояние всех таблиц сдвигается на время снимка,
+            чтобы обычная синхронизация догрузила изменения после него.
+
+        Args:
+            file_name (str, optional): Файл снимка. По умолчанию SNAPSHOT_FILE.
+
+        Returns:
+            int: Количество загруженных фильмов.
+        """
+        self._check_shards()
+        file_name = file_name or config.snapshot.file_name
+        logger.info("Загрузка снимка из %s.", file_name)
+        with gzip.open(file_name, "rb") as file:
+            snapshot_time = orjson.loads(file.readline())["snapshot"]
+            self.es_loader.start_rebuild()
+            counter, _ = self.es_loader.bulk_insert_stream(self.read_documents(file))
+        self.es_loader.finish_rebuild()
+        for table_name in TABLES:
+            self.state.save_storage(table_name, make_cursor(snapshot_time))
+        self.state.flush()
+        logger.info("Из снимка на %s загружено %s фильмов.", snapshot_time, counter)
+        return counter
+
+    def read_documents(self, file) -> Iterator[tuple[str, dict]]:
+        """Функция читает документы снимка построчно, не загружая файл в
+            память целиком.
+
+        Args:
+            file (GzipFile): Открытый файл снимка после строки заголовка.
+
+        Yields:
+            tuple[str, dict]: Айдишник фильма и документ для вставки в ES.
+        """
+        for line in file:
+            document = orjson.loads(line)
+            yield document["id"], document
+
+    def _check_shards(self) -> None:
+        if config.shard.count > 1:
+            raise RuntimeError("Снимок не поддерживается в режиме шардов.")
+
+
+if __name__ == "__main__":
+    etl = SnapshotEtlProcess()
+    command, *args = sys.argv[1:] or ["export"]
+    if command == "export":
+        etl.export(*args)
+    elif command == "replay":
+        etl.replay(*args)
+    else:
+        raise SystemExit("Использование: python3 snapshot.py export|replay [файл]")
@@ -1,8 +1,16 @@
 import json
+import os
+import tempfile
+import time
 from abc import ABC, abstractmethod
 from typing import Any, Dict
 
 from config import load_config
+from metrics import timed
+from redis import Redis
+from redis.client import Pipeline
+
+REDIS_BACKEND = "redis"
 
 
 class BaseStorage(ABC):
@@ -15,28 +23,62 @@ class BaseStorage(ABC):
     def retrieve_state(self) -> Dict[str, Any]:
         pass
 
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """Функция сохраняет значение, только если текущее значение равно
+            ожидаемому. Реализация по умолчанию не атомарна между процессами.
+
+        Args:
+            key (str): Состояние.
+            expected (Any): Ожидаемое текущее значение.
+            value (Any): Новое значение.
+
+        Returns:
+            bool: Значение сохранено.
+        """
+        if self.retrieve_state().get(key, None) != expected:
+            return False
+        self.save_state({key: value})
+        return True
+
 
 class JsonStorage(BaseStorage):
+    """Хранилище состояния в JSON-файле. Файл рассчитан на один процесс,
+    поэтому у каждого шарда свой файл с суффиксом префикса шарда.
+    """
 
-    def __init__(self):
-        self.file_path = load_config().state.file_name
+    def __init__(self, prefix: str = ""):
+        self.file_path = self.shared_path = load_config().state.file_name
+        if prefix:
+            self.file_path = f"{self.shared_path}.{prefix.rstrip(':')}"
 
+    @timed("state_write")
     def save_state(self, state: Dict[str, Any]) -> None:
-        """Функция сохраняет состояние.
+        """Функция атомарно сохраняет состояние: данные пишутся во временный
+            файл, сбрасываются на диск и переименовываются поверх основного.
 
         Args:
             state (Dict[str, Any]): Словарь с состоянием и его значением.
         """
-        data = {}
+        data = self.retrieve_state()
+        data.update(state)
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix=f"{os.path.basename(self.file_path)}.", suffix=".tmp"
+        )
         try:
-            with open(self.file_path, "r") as file:
-                data = json.load(file)
-        except FileNotFoundError:
-            pass
-        finally:
-            with open(self.file_path, "w") as file:
-                data.update(state)
+            with os.fdopen(fd, "w") as file:
                 json.dump(data, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def retrieve_state(self) -> Dict[str, Any]:
         """Функция получает состояние из файла.
@@ -44,18 +86,94 @@ class JsonStorage(BaseStorage):
         Returns:
             Dict[str, Any]: Словарь с состояниями.
         """
-        try:
-            with open(self.file_path, "r") as file:
-                data = json.load(file)
-            return data
-        except FileNotFoundError:
-            return {}
+        for file_path in dict.fromkeys((self.file_path, self.shared_path)):
+            # до появления отдельного файла шарда его курсоры читаются из
+            # общего файла, куда их сохраняли раньше
+            try:
+                with open(file_path, "r") as file:
+                    return json.load(file)
+            except FileNotFoundError:
+                continue
+        return {}
+
+
+class RedisStorage(BaseStorage):
+    """Хранилище состояния в хеше Redis: каждое состояние хранится
+    в отдельном поле в виде JSON, поэтому несколько процессов ETL
+    могут работать с общим прогрессом.
+    """
+
+    def __init__(self, client: Redis = None, key: str = None):
+        config = load_config().redis
+        self.client = client or Redis(
+            host=config.host, port=config.port, db=config.db, decode_responses=True
+        )
+        self.key = key or config.state_key
+
+    @timed("state_write")
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Функция сохраняет все переданные состояния одной транзакцией.
+
+        Args:
+            state (Dict[str, Any]): Словарь с состоянием и его значением.
+        """
+        if not state:
+            return
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                self.key,
+                mapping={key: json.dumps(value) for key, value in state.items()},
+            )
+            pipe.execute()
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Функция получает все состояния из хеша.
+
+        Returns:
+            Dict[str, Any]: Словарь с состояниями.
+        """
+        data = self.client.hgetall(self.key)
+        return {self._decode(key): json.loads(value) for key, value in data.items()}
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """Функция атомарно сохраняет значение, только если текущее значение
+            равно ожидаемому (WATCH/MULTI/EXEC).
+
+        Args:
+            key (str): Состояние.
+            expected (Any): Ожидаемое текущее значение.
+            value (Any): Новое значение.
+
+        Returns:
+            bool: Значение сохранено.
+        """
+        is_set = False
+
+        def update(pipe: Pipeline) -> None:
+            nonlocal is_set
+            current = pipe.hget(self.key, key)
+            current = json.loads(current) if current is not None else None
+            is_set = current == expected
+            if is_set:
+                pipe.multi()
+                pipe.hset(self.key, key, json.dumps(value))
+
+        self.client.transaction(update, self.key)
+        return is_set
+
+    @staticmethod
+    def _decode(key: str | bytes) -> str:
+        return key.decode() if isinstance(key, bytes) else key
 
 
 class State:
 
-    def __init__(self, storage: BaseStorage) -> None:
+    def __init__(self, storage: BaseStorage, prefix: str = "") -> None:
         self.storage = storage
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
 
     def save_storage(self, key: str, value: Any) -> None:
         """Функция принимает состояние и его значение и
@@ -65,7 +183,7 @@ class State:
             key (str): Состояние
             value (Any): Значение состояния
         """
-        self.storage.save_state({key: value})
+        self.storage.save_state({self._key(key): value})
 
     def get_storage(self, key: str) -> Any:
         """Функция получает значение указанного состояния.
@@ -76,4 +194,139 @@ class State:
         Returns:
             Any: Значение состояния.
         """
-        return self.storage.retrieve_state().get(key, None)
+        return self.storage.retrieve_state().get(self._key(key), None)
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """Функция сохраняет значение, только если текущее значение равно ожидаемому.
+
+        Args:
+            key (str): Состояние.
+            expected (Any): Ожидаемое текущее значение.
+            value (Any): Новое значение.
+
+        Returns:
+            bool: Значение сохранено.
+        """
+        return self.storage.compare_and_set(self._key(key), expected, value)
+
+    def checkpoint(self) -> None:
+        """Функция вызывается после обработки пачки. Состояние уже сохранено."""
+        pass
+
+    def flush(self) -> None:
+        """Функция сохраняет отложенные изменения. Состояние уже сохранено."""
+        pass
+
+
+class CachedState(State):
+    """Состояние, которое хранится в памяти и сбрасывается в хранилище
+    после каждых flush_batches пачек, не реже чем раз в flush_interval
+    секунд и при завершении процесса.
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        flush_batches: int = 10,
+        flush_interval: float = 5,
+        prefix: str = "",
+    ) -> None:
+        super().__init__(storage, prefix)
+        self.flush_batches = flush_batches
+        self.flush_interval = flush_interval
+        self.cache = storage.retrieve_state()
+        self.changed = {}
+        self.expected = {}
+        self.batches = 0
+        self.flushed_at = time.monotonic()
+
+    def save_storage(self, key: str, value: Any) -> None:
+        """Функция сохраняет значение состояния в памяти.
+
+        Args:
+            key (str): Состояние
+            value (Any): Значение состояния
+        """
+        self.cache[self._key(key)] = value
+        self.changed[self._key(key)] = value
+        self.expected.pop(self._key(key), None)
+
+    def get_storage(self, key: str) -> Any:
+        """Функция получает значение указанного состояния из памяти.
+
+        Args:
+            key (str): Состояние.
+
+        Returns:
+            Any: Значение состояния.
+        """
+        return self.cache.get(self._key(key), None)
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """Функция сравнивает значение в памяти и откладывает запись. При
+            сбросе значение записывается в хранилище, только если там все
+            еще значение, прочитанное до первого отложенного изменения.
+
+        Args:
+            key (str): Состояние.
+            expected (Any): Ожидаемое текущее значение.
+            value (Any): Новое значение.
+
+        Returns:
+            bool: Значение сохранено в памяти.
+        """
+        key = self._key(key)
+        if self.cache.get(key, None) != expected:
+            return False
+        self.expected.setdefault(key, expected)
+        self.cache[key] = value
+        self.changed[key] = value
+        return True
+
+    def checkpoint(self) -> None:
+        """Функция отмечает обработанную пачку и сбрасывает состояние
+        в хранилище, если сработала политика сброса.
+        """
+        self.batches += 1
+        if (
+            self.batches >= self.flush_batches
+            or time.monotonic() - self.flushed_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Функция сохраняет в хранилище все изменения одной записью.
+        Значения, измененные через compare_and_set, записываются каждое
+        своим сравнением с записью; если другой процесс успел их изменить,
+        в память загружается его значение.
+        """
+        for key, expected in self.expected.items():
+            value = self.changed.pop(key)
+            if not self.storage.compare_and_set(key, expected, value):
+                self.cache[key] = self.storage.retrieve_state().get(key, None)
+        self.expected = {}
+        if self.changed:
+            self.storage.save_state(self.changed)
+            self.changed = {}
+        self.batches = 0
+        self.flushed_at = time.monotonic()
+
+
+def get_state(storage: BaseStorage = None, prefix: str = "") -> State:
+    """Функция создает объект состояния в соответствии с конфигом.
+
+    Args:
+        storage (BaseStorage, optional): Хранилище. По умолчанию выбирается по STATE_BACKEND.
+        prefix (str, optional): Префикс ключей состояния. Defaults to "".
+
+    Returns:
+        State: Объект состояния.
+    """
+    config = load_config().state
+    if storage is None:
+        storage = (
+            RedisStorage() if config.backend == REDIS_BACKEND else JsonStorage(prefix)
+        )
+    if config.cached:
+        return CachedState(storage, config.flush_batches, config.flush_interval, prefix)
+    return State(storage, prefix)
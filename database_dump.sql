@@ -14001,6 +14001,27 @@ ALTER TABLE ONLY public.django_session
 CREATE INDEX film_work_creation_rating_idx ON content.film_work USING btree (creation_date, rating);
 
 
+--
+-- Name: film_work_modified_idx; Type: INDEX; Schema: content; Owner: postgres
+--
+
+CREATE INDEX film_work_modified_idx ON content.film_work USING btree (modified, id);
+
+
+--
+-- Name: genre_modified_idx; Type: INDEX; Schema: content; Owner: postgres
+--
+
+CREATE INDEX genre_modified_idx ON content.genre USING btree (modified, id);
+
+
+--
+-- Name: person_modified_idx; Type: INDEX; Schema: content; Owner: postgres
+--
+
+CREATE INDEX person_modified_idx ON content.person USING btree (modified, id);
+
+
 --
 -- Name: film_work_genre_idx; Type: INDEX; Schema: content; Owner: postgres
 --
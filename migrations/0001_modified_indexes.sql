@@ -0,0 +1,9 @@
+-- Индексы для постраничной выборки изменений по (modified, id).
+-- CONCURRENTLY не блокирует запись, поэтому миграцию можно применять
+-- на работающей базе: psql -f migrations/0001_modified_indexes.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_modified_idx ON content.film_work USING btree (modified, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_modified_idx ON content.genre USING btree (modified, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_modified_idx ON content.person USING btree (modified, id);
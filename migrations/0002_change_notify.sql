@@ -0,0 +1,64 @@
+-- Уведомления об изменениях в схеме content для ETL (python3 listener.py).
+-- В канал content_changes отправляется JSON {"table": ..., "id": ...}:
+-- для film_work, person и genre - айдишник измененной строки, для таблиц
+-- связи - айдишник фильма. Одинаковые уведомления внутри одной транзакции
+-- Postgres отправляет один раз.
+-- psql -f migrations/0002_change_notify.sql
+
+CREATE OR REPLACE FUNCTION content.notify_change() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    changed_row record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_row := OLD;
+    ELSE
+        changed_row := NEW;
+    END IF;
+    PERFORM pg_notify(
+        'content_changes',
+        json_build_object('table', TG_TABLE_NAME, 'id', changed_row.id)::text
+    );
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION content.notify_film_work_link_change() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    changed_row record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_row := OLD;
+    ELSE
+        changed_row := NEW;
+    END IF;
+    PERFORM pg_notify(
+        'content_changes',
+        json_build_object('table', TG_TABLE_NAME, 'id', changed_row.film_work_id)::text
+    );
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER film_work_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_change();
+
+CREATE OR REPLACE TRIGGER person_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.notify_change();
+
+CREATE OR REPLACE TRIGGER genre_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.notify_change();
+
+CREATE OR REPLACE TRIGGER person_film_work_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_film_work_link_change();
+
+CREATE OR REPLACE TRIGGER genre_film_work_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_film_work_link_change();